@@ -0,0 +1,157 @@
+from flask import current_app
+from flask.cli import AppGroup
+from compression import write_compressed
+from resources import lazy
+import os
+import re
+import json
+import click
+import shutil
+import hashlib
+import posixpath
+
+# ================= FINGERPRINTED ASSETS =================
+# `flask assets build` minifies every css/js/json file under static/,
+# writes it as static/dist/<path>.<hash>.<ext> (plus .gz/.br) and
+# records the mapping in static/dist/assets.json. url_for('static', ...)
+# then resolves to the hashed name, and hashed files are served as
+# immutable for a year. Without a build the plain files are used.
+
+ASSET_DIR = "dist"
+ASSET_MANIFEST = "assets.json"
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def minify_css(text):
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s*([{};,>])\s*", r"\1", text)
+    text = re.sub(r":\s+", ":", text)
+    return text.replace(";}", "}").strip()
+
+
+def minify_js(text):
+    # conservative on purpose: several scripts rely on automatic
+    # semicolon insertion, so line breaks stay and only indentation,
+    # blank lines and whole-line comments go
+    lines = []
+
+    for line in text.splitlines():
+        line = line.strip()
+
+        if not line or re.fullmatch(r"/\*.*\*/|//.*", line):
+            continue
+
+        lines.append(line)
+
+    return "\n".join(lines) + "\n"
+
+
+def minify_json(text):
+    return json.dumps(json.loads(text), separators=(",", ":"))
+
+
+MINIFIERS = {".css": minify_css, ".js": minify_js, ".json": minify_json}
+
+
+def rebase_css_urls(text, rel):
+    # relative url()s in a stylesheet moved into dist/ must still point
+    # at the original files (vendored Leaflet's marker/layer images)
+    src_dir = posixpath.dirname(rel)
+    dst_dir = posixpath.join(ASSET_DIR, src_dir)
+
+    def fix(m):
+        url = m.group(2)
+
+        if re.match(r"[a-z]+:|/|#", url):
+            return m.group(0)
+
+        target = posixpath.normpath(posixpath.join(src_dir, url))
+        quote = m.group(1)
+
+        return f"url({quote}{posixpath.relpath(target, dst_dir)}{quote})"
+
+    return re.sub(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""", fix, text)
+
+
+def asset_manifest():
+    path = os.path.join(current_app.static_folder, ASSET_DIR, ASSET_MANIFEST)
+
+    def load():
+        try:
+            with open(path) as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
+
+    return lazy("asset_manifest", load)
+
+
+def fingerprint_static(endpoint, values):
+    if endpoint == "static" and "filename" in values:
+        values["filename"] = asset_manifest().get(
+            values["filename"], values["filename"]
+        )
+
+
+@click.group("assets", cls=AppGroup)
+def assets_cli():
+    """Fingerprinted static assets."""
+
+
+@assets_cli.command("build")
+def assets_build():
+    """Minify and content-hash static assets into static/dist."""
+    static = current_app.static_folder
+    out = os.path.join(static, ASSET_DIR)
+
+    shutil.rmtree(out, ignore_errors=True)
+
+    manifest = {}
+    before = after = 0
+
+    for dirpath, dirs, files in os.walk(static):
+        if dirpath == static:
+            dirs[:] = [d for d in dirs if d != ASSET_DIR]
+
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+
+            if ext not in MINIFIERS:
+                continue
+
+            src = os.path.join(dirpath, name)
+            rel = os.path.relpath(src, static).replace(os.sep, "/")
+
+            with open(src, encoding="utf-8") as fh:
+                raw = fh.read()
+
+            body = MINIFIERS[ext](raw)
+
+            if ext == ".css":
+                body = rebase_css_urls(body, rel)
+
+            body = body.encode()
+            digest = hashlib.sha256(body).hexdigest()[:10]
+
+            hashed = posixpath.join(
+                ASSET_DIR, posixpath.dirname(rel), f"{stem}.{digest}{ext}"
+            )
+            dst = os.path.join(static, hashed)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+            with open(dst, "wb") as fh:
+                fh.write(body)
+
+            sent = write_compressed(dst, body)
+            manifest[rel] = hashed
+
+            before += len(raw.encode())
+            after += sent
+
+            click.echo(f"{rel} -> {hashed} ({len(raw.encode())} -> {sent} bytes)")
+
+    with open(os.path.join(out, ASSET_MANIFEST), "w") as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+
+    click.echo(f"{len(manifest)} assets, {before} -> {after} bytes over the wire")
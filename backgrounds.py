@@ -0,0 +1,161 @@
+from flask import current_app, url_for
+from flask.cli import with_appcontext
+from resources import http, lazy
+import os
+import io
+import json
+import click
+import shutil
+import hashlib
+import posixpath
+
+# ================= BACKGROUNDS =================
+# Page backgrounds are chosen from the weather condition on the server.
+# `flask assets backgrounds` resizes one source photo per condition into
+# content-hashed AVIF/WebP files under static/images/bg, recorded in
+# backgrounds.json. Pages preload the variant for their viewport and set
+# it with image-set(); without a build the source photo is used as is.
+
+BACKGROUND_DIR = "images/bg"
+BACKGROUND_MANIFEST = "backgrounds.json"
+BACKGROUND_WIDTHS = (640, 1280, 1920)
+BACKGROUND_FORMATS = (
+    ("avif", "image/avif", {"quality": 50, "speed": 4}),
+    ("webp", "image/webp", {"quality": 72, "method": 6})
+)
+
+BACKGROUND_SOURCES = {
+    "clear": "https://images.pexels.com/photos/912110/pexels-photo-912110.jpeg",
+    "clouds": "https://images.pexels.com/photos/531767/pexels-photo-531767.jpeg",
+    "rain": "https://images.unsplash.com/photo-1519692933481-e162a57d6721?auto=format&fit=crop&w=2000&q=80.jpeg",
+    "snow": "https://images.pexels.com/photos/688660/pexels-photo-688660.jpeg",
+    "mist": "https://images.pexels.com/photos/167699/pexels-photo-167699.jpeg"
+}
+
+BACKGROUND_CONDITIONS = {
+    "Clear": "clear",
+    "Clouds": "clouds",
+    "Rain": "rain",
+    "Drizzle": "rain",
+    "Thunderstorm": "rain",
+    "Snow": "snow",
+    "Mist": "mist",
+    "Fog": "mist",
+    "Haze": "mist",
+    "Smoke": "mist",
+    "Dust": "mist",
+    "Sand": "mist",
+    "Ash": "mist"
+}
+
+
+def background_manifest():
+    path = os.path.join(
+        current_app.static_folder, BACKGROUND_DIR, BACKGROUND_MANIFEST
+    )
+
+    def load():
+        try:
+            with open(path) as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
+
+    return lazy("background_manifest", load)
+
+
+def background_for(main):
+    # str(): a streamed page passes a Deferred
+    condition = BACKGROUND_CONDITIONS.get(str(main), "clouds")
+    built = background_manifest().get(condition)
+
+    if not built:
+        return {"fallback": BACKGROUND_SOURCES[condition], "sizes": []}
+
+    sizes = []
+    low = 0
+
+    for i, width in enumerate(BACKGROUND_WIDTHS):
+        media = [f"(min-width: {low + 1}px)"] if low else []
+
+        if i < len(BACKGROUND_WIDTHS) - 1:
+            media.append(f"(max-width: {width}px)")
+
+        sizes.append({
+            "media": " and ".join(media) or "all",
+            "images": [
+                (url_for("static", filename=built[str(width)][ext]), mime)
+                for ext, mime, _opts in BACKGROUND_FORMATS
+                if ext in built[str(width)]
+            ]
+        })
+        low = width
+
+    return {"fallback": sizes[-1]["images"][-1][0], "sizes": sizes}
+
+
+@click.command("backgrounds")
+@click.option(
+    "--source", type=click.Path(exists=True, file_okay=False),
+    help="Directory of <condition>.<ext> originals instead of downloading."
+)
+@with_appcontext
+def assets_backgrounds(source):
+    """Resize condition backgrounds into AVIF/WebP under static/images/bg."""
+    try:
+        from PIL import Image, features
+    except ImportError:
+        raise click.ClickException("assets backgrounds needs Pillow")
+
+    out = os.path.join(current_app.static_folder, BACKGROUND_DIR)
+    shutil.rmtree(out, ignore_errors=True)
+    os.makedirs(out)
+
+    formats = [f for f in BACKGROUND_FORMATS if features.check(f[0])]
+    manifest = {}
+
+    for condition, url in BACKGROUND_SOURCES.items():
+        if source:
+            names = [
+                n for n in os.listdir(source)
+                if os.path.splitext(n)[0] == condition
+            ]
+
+            if not names:
+                raise click.ClickException(f"no source image for {condition}")
+
+            original = Image.open(os.path.join(source, names[0]))
+        else:
+            r = http().get(url, timeout=30)
+            r.raise_for_status()
+            original = Image.open(io.BytesIO(r.content))
+
+        original = original.convert("RGB")
+        manifest[condition] = {}
+
+        for width in BACKGROUND_WIDTHS:
+            # never upscale; a small original is stored at its own size
+            scale = min(1, width / original.width)
+            img = original.resize(
+                (round(original.width * scale), round(original.height * scale)),
+                Image.LANCZOS
+            )
+            manifest[condition][str(width)] = {}
+
+            for ext, _mime, opts in formats:
+                buf = io.BytesIO()
+                img.save(buf, ext.upper(), **opts)
+                body = buf.getvalue()
+                digest = hashlib.sha256(body).hexdigest()[:10]
+                name = f"{condition}-{width}.{digest}.{ext}"
+
+                with open(os.path.join(out, name), "wb") as fh:
+                    fh.write(body)
+
+                manifest[condition][str(width)][ext] = posixpath.join(
+                    BACKGROUND_DIR, name
+                )
+                click.echo(f"{condition} {width}w {ext}: {len(body)} bytes")
+
+    with open(os.path.join(out, BACKGROUND_MANIFEST), "w") as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
@@ -0,0 +1,189 @@
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.datastructures import Headers
+from werkzeug.http import (
+    parse_accept_header, parse_set_header, quote_etag, unquote_etag
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+import os
+import gzip
+import click
+import threading
+
+# ================= COMPRESSION =================
+# Dynamic responses above COMPRESS_MIN_BYTES are gzip/brotli encoded by
+# a WSGI middleware. Pages from the render cache arrive already encoded
+# and pass through untouched, and so do streamed responses (no
+# Content-Length), which must not be buffered. Static files are served
+# from .br/.gz siblings prepared at deploy time by `flask
+# compress-static`.
+
+COMPRESSIBLE = (
+    "text/html", "text/css", "text/plain", "text/csv",
+    "application/json", "application/javascript", "text/javascript",
+    "application/manifest+json", "image/svg+xml"
+)
+STATIC_COMPRESS = (".css", ".js", ".json", ".svg", ".html", ".txt")
+
+
+def negotiate_encoding(header):
+    accept = parse_accept_header(header)
+
+    if brotli is not None and accept["br"]:
+        return "br"
+
+    if accept["gzip"]:
+        return "gzip"
+
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+
+    return gzip.compress(body, 6)
+
+
+class CompressionStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.responses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def record(self, raw, sent):
+        with self._lock:
+            self.responses += 1
+            self.bytes_in += raw
+            self.bytes_out += sent
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "responses": self.responses,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out
+            }
+
+
+compression_stats = CompressionStats()
+
+
+class Compress:
+
+    def __init__(self, wsgi_app, min_size):
+        self.wsgi_app = wsgi_app
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate_encoding(environ.get("HTTP_ACCEPT_ENCODING", ""))
+
+        # HEAD and the rest go through untouched: there is no body worth
+        # encoding, and an encoded empty one would carry a bogus length
+        if encoding is None or environ.get("REQUEST_METHOD") != "GET":
+            return self.wsgi_app(environ, start_response)
+
+        # start_response is only forwarded once we know the headers
+        pending = []
+        written = []
+
+        def hold(status, headers, exc_info=None):
+            pending[:] = [status, headers, exc_info]
+            return written.append
+
+        app_iter = self.wsgi_app(environ, hold)
+        status, headers, exc_info = pending
+        h = Headers(headers)
+
+        if not self._compressible(status, h):
+            write = start_response(status, headers, exc_info)
+
+            for data in written:
+                write(data)
+
+            return app_iter
+
+        try:
+            body = b"".join(written) + b"".join(app_iter)
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+
+        encoded = compress(body, encoding)
+        compression_stats.record(len(body), len(encoded))
+
+        h["Content-Encoding"] = encoding
+        h["Content-Length"] = str(len(encoded))
+
+        vary = parse_set_header(h.get("Vary"))
+        vary.add("Accept-Encoding")
+        h["Vary"] = vary.to_header()
+
+        etag = h.get("ETag")
+
+        if etag and not etag.startswith("W/"):
+            h["ETag"] = quote_etag(unquote_etag(etag)[0], weak=True)
+
+        start_response(status, h.to_wsgi_list(), exc_info)
+        return [encoded]
+
+    def _compressible(self, status, headers):
+        return (
+            status.startswith("200")
+            and "Content-Encoding" not in headers
+            and headers.get("Content-Type", "").split(";")[0] in COMPRESSIBLE
+            and int(headers.get("Content-Length") or 0) >= self.min_size
+        )
+
+
+def write_compressed(path, raw):
+    # writes .gz/.br siblings of `path`; returns the smallest size
+    variants = [(".gz", gzip.compress(raw, 9, mtime=0))]
+
+    if brotli is not None:
+        variants.append((".br", brotli.compress(raw, quality=11)))
+
+    for ext, data in variants:
+        # a sibling that does not shrink the file is not written
+        if len(data) < len(raw):
+            with open(path + ext, "wb") as fh:
+                fh.write(data)
+
+    return min(len(raw), *(len(data) for _ext, data in variants))
+
+
+@click.command("compress-static")
+@with_appcontext
+def compress_static():
+    """Write .gz/.br siblings for text assets under static/."""
+    saved = total = 0
+
+    for dirpath, _dirs, files in os.walk(current_app.static_folder):
+        for name in files:
+            if not name.endswith(STATIC_COMPRESS):
+                continue
+
+            path = os.path.join(dirpath, name)
+
+            with open(path, "rb") as fh:
+                raw = fh.read()
+
+            best = write_compressed(path, raw)
+
+            if best < len(raw):
+                total += len(raw)
+                saved += len(raw) - best
+
+                click.echo(
+                    f"{os.path.relpath(path, current_app.static_folder)}: "
+                    f"{len(raw)} -> {best} bytes"
+                )
+
+    click.echo(f"saved {saved} of {total} bytes")
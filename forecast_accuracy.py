@@ -0,0 +1,173 @@
+from flask.cli import with_appcontext
+from resources import get_db
+from datetime import datetime, timedelta
+import numpy as np
+import time
+import click
+
+# ================= FORECAST ACCURACY =================
+# `flask score-forecasts` pairs every stored forecast slot with the
+# observation nearest to its valid time (same city, within 30 min) and
+# scores the temperature error per city and lead time. Rows are loaded
+# straight into NumPy columns and matched/aggregated with searchsorted
+# and bincount, never one document at a time. The summary lands in
+# forecast_accuracy and is served by /api/forecast-accuracy.
+
+MATCH_TOLERANCE_S = 1800
+LEAD_STEP_H = 3
+LOAD_BATCH = 50000
+ACCURACY_STAGING = "forecast_accuracy_staging"
+
+
+
+def load_columns(cursor, columns, names=None):
+    # columns: {field: dtype}; datetimes become datetime64[s]
+    chunks = {f: [] for f in columns}
+    buf = {f: [] for f in columns}
+
+    def flush():
+        for f, dtype in columns.items():
+            chunks[f].append(np.array(buf[f], dtype=dtype))
+            buf[f].clear()
+
+    for doc in cursor:
+        for f in columns:
+            buf[f].append(doc[f])
+
+        if names is not None:
+            names[doc["city_id"]] = doc.get("city")
+
+        if len(buf["city_id"]) == LOAD_BATCH:
+            flush()
+
+    flush()
+
+    return {f: np.concatenate(chunks[f]) for f in columns}
+
+
+def score_forecasts(fc, ob):
+    # one sortable int64 key per row: city in the high bits, unix
+    # seconds in the low 32
+    def key(city, ts):
+        return (city.astype(np.int64) << 32) + ts.astype("int64")
+
+    order = np.argsort(key(ob["city_id"], ob["ts"]), kind="stable")
+    okey = key(ob["city_id"], ob["ts"])[order]
+    otemp = ob["temp"][order]
+
+    fkey = key(fc["city_id"], fc["ts"])
+
+    hi = np.clip(np.searchsorted(okey, fkey), 0, len(okey) - 1)
+    lo = np.clip(hi - 1, 0, len(okey) - 1)
+    nearest = np.where(np.abs(okey[lo] - fkey) < np.abs(okey[hi] - fkey), lo, hi)
+
+    # the key difference is the time gap only when the cities match
+    ok = np.abs(okey[nearest] - fkey) <= MATCH_TOLERANCE_S
+
+    err = fc["temp"][ok] - otemp[nearest[ok]]
+    lead_s = (fc["ts"][ok] - fc["fetched"][ok]).astype("int64")
+    lead = np.maximum(lead_s // (LEAD_STEP_H * 3600), 0) * LEAD_STEP_H
+
+    groups = (fc["city_id"][ok].astype(np.int64) << 16) + lead
+    uniq, inv = np.unique(groups, return_inverse=True)
+
+    n = np.bincount(inv)
+    bias = np.bincount(inv, weights=err) / n
+    mae = np.bincount(inv, weights=np.abs(err)) / n
+    rmse = np.sqrt(np.bincount(inv, weights=err * err) / n)
+
+    return {
+        "city_id": uniq >> 16,
+        "lead_h": uniq & 0xFFFF,
+        "n": n,
+        "bias": bias,
+        "mae": mae,
+        "rmse": rmse,
+        "matched": int(ok.sum()),
+        "total": len(fkey)
+    }
+
+
+@click.command("score-forecasts")
+@click.option("--days", default=30, show_default=True,
+              help="Score forecasts valid in the last N days.")
+@with_appcontext
+def score_forecasts_command(days):
+    """Score stored forecasts against observations (MAE/bias per lead)."""
+    db = get_db()
+    scored = datetime.utcnow()
+    query = {"ts": {"$gte": scored - timedelta(days=days), "$lt": scored}}
+    names = {}
+
+    started = time.perf_counter()
+
+    fc = load_columns(db.forecasts.find(
+        query,
+        {"_id": 0, "city_id": 1, "city": 1, "ts": 1, "fetched": 1, "temp": 1}
+    ).batch_size(LOAD_BATCH), {
+        "city_id": np.int64,
+        "ts": "datetime64[s]",
+        "fetched": "datetime64[s]",
+        "temp": np.float64
+    }, names)
+
+    query["ts"]["$gte"] -= timedelta(seconds=MATCH_TOLERANCE_S)
+    query["ts"]["$lt"] += timedelta(seconds=MATCH_TOLERANCE_S)
+
+    ob = load_columns(db.observations.find(
+        query,
+        {"_id": 0, "city_id": 1, "ts": 1, "temp": 1}
+    ).batch_size(LOAD_BATCH), {
+        "city_id": np.int64,
+        "ts": "datetime64[s]",
+        "temp": np.float64
+    })
+
+    loaded = time.perf_counter()
+
+    if not len(fc["ts"]) or not len(ob["ts"]):
+        click.echo("nothing to score")
+        return
+
+    result = score_forecasts(fc, ob)
+    done = time.perf_counter()
+
+    if not len(result["n"]):
+        click.echo(
+            f"no forecast matched an observation "
+            f"(0/{result['total']}); summary left as it was"
+        )
+        return
+
+    # build the new summary aside and swap it in with one rename, so
+    # /api/forecast-accuracy never reads a half-written or empty table
+    staging = db[ACCURACY_STAGING]
+    staging.drop()
+    staging.insert_many([
+        {
+            "city_id": int(city_id),
+            "city": names.get(int(city_id)),
+            "lead_h": int(lead),
+            "n": int(n),
+            "mae": round(float(mae), 3),
+            "bias": round(float(bias), 3),
+            "rmse": round(float(rmse), 3),
+            "scored": scored
+        }
+        for city_id, lead, n, mae, bias, rmse in zip(
+            result["city_id"], result["lead_h"], result["n"],
+            result["mae"], result["bias"], result["rmse"]
+        )
+    ])
+    staging.create_index([("city_id", 1), ("lead_h", 1)])
+    staging.rename("forecast_accuracy", dropTarget=True)
+
+    rows = len(fc["ts"]) + len(ob["ts"])
+
+    click.echo(
+        f"loaded {rows} rows in {loaded - started:.2f}s "
+        f"({rows / max(loaded - started, 1e-9):,.0f} rows/s); "
+        f"scored {result['matched']}/{result['total']} forecasts in "
+        f"{done - loaded:.3f}s "
+        f"({result['total'] / max(done - loaded, 1e-9):,.0f} rows/s)"
+    )
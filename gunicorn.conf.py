@@ -0,0 +1,47 @@
+import gc
+import multiprocessing
+import os
+
+# ================= WORKERS =================
+# Every request spends most of its time waiting on OWM or Mongo, so a
+# few processes with many threads (or greenlets) beat one process per
+# request. gthread needs nothing beyond gunicorn itself; set
+# GUNICORN_WORKER_CLASS=gevent when gevent is installed.
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+wsgi_app = "wsgi:app"
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "200"))
+
+timeout = 30
+graceful_timeout = 20
+keepalive = 5
+
+# recycle workers now and then so slow leaks cannot accumulate
+max_requests = 5000
+max_requests_jitter = 500
+
+# ================= PRELOAD =================
+# The app is imported once in the master and forked. create_app() opens
+# no connections, so nothing shared leaks into the children.
+preload_app = True
+
+
+def when_ready(server):
+    # move everything the import created into the permanent generation;
+    # the collector then never touches (and dirties) those pages in the
+    # workers, so they stay shared copy-on-write
+    gc.collect()
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # runs in the child after the worker class has set itself up (and,
+    # for gevent, after monkey-patching), so threads started here use
+    # the worker's own I/O primitives
+    from resources import start_background
+
+    start_background(worker.wsgi)
@@ -1,290 +1,2504 @@
-from flask import Flask, request, jsonify, render_template, url_for, redirect
-from pymongo import MongoClient
-import requests
-from datetime import datetime, timedelta
+from flask import (
+    Flask, Blueprint, current_app, request, jsonify, render_template,
+    url_for, redirect, stream_with_context
+)
+from pymongo import ReadPreference, ReturnDocument, WriteConcern
+from pymongo.errors import (
+    CollectionInvalid, DuplicateKeyError, OperationFailure, PyMongoError
+)
+from bson import ObjectId
+from bson.errors import InvalidId
+import numpy as np
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from datetime import datetime, timedelta, timezone
 import os
+import io
+import csv
+import gzip
+import mimetypes
+import re
+import asyncio
+import json
+import time
+import math
+import hashlib
+import logging
+import socket
+import threading
 from dotenv import load_dotenv
-from collections import defaultdict, Counter
+from compression import (
+    Compress, compress_static, compression_stats, negotiate_encoding
+)
+from assets import (
+    ASSET_DIR, ASSET_MANIFEST, IMMUTABLE_MAX_AGE, assets_cli,
+    fingerprint_static
+)
+from backgrounds import (
+    BACKGROUND_DIR, BACKGROUND_MANIFEST, assets_backgrounds, background_for
+)
+from parquet_export import export_observations
+from forecast_accuracy import score_forecasts_command
+from tiles import TileCache
+from resources import (
+    aggregate_list, async_db, background, get_db, http, lazy, on_mongo,
+    process_state, run_mongo, start_background
+)
+from werkzeug.http import parse_accept_header
+from werkzeug.security import safe_join
+from collections import defaultdict, OrderedDict
+from concurrent.futures import Future
 from datetime import datetime as _dt
 
-# ================= ENV =================
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# ================= HISTORY COLLECTIONS =================
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST
+}
+
+
+def history_writes(db=None):
+    w = current_app.config["MONGO_HISTORY_W"]
+
+    return (db if db is not None else get_db()).get_collection(
+        "weather",
+        write_concern=WriteConcern(w=int(w) if w.isdigit() else w)
+    )
+
+
+def history_reads(db=None):
+    return (db if db is not None else get_db()).get_collection(
+        "weather",
+        read_preference=READ_PREFERENCES[
+            current_app.config["MONGO_HISTORY_READ_PREFERENCE"]
+        ]
+    )
+
+# ================= ROUTES =================
+bp = Blueprint("weather", __name__)
+
+# ================= CACHE =================
+class TTLCache:
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+
+            if hit is None:
+                return None
+
+            expires, value = hit
+
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def cached_json(body, etag, max_age):
+    resp = current_app.response_class(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = max_age
+    return resp.make_conditional(request)
+
+# ================= HTTP VALIDATORS =================
+# Pages and APIs carry a strong ETag built from the upstream data
+# timestamp and the template version, plus a max-age equal to the time
+# left until upstream publishes new data. A matching If-None-Match is
+# answered with 304 before any template is rendered.
+
+SWR_SECONDS = 60
+
+
+def make_etag(*parts):
+    # units/lang are always metric/English today, but a client passing
+    # them must never be handed a validator for another variant
+    parts += (
+        request.args.get("units", "metric"),
+        request.args.get("lang", "en"),
+        current_template_version()
+    )
+
+    return hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()
+
+
+def set_validators(resp, etag, max_age):
+    # an encoded body is a different representation of the same page,
+    # so it only gets a weak validator
+    resp.set_etag(etag, weak="Content-Encoding" in resp.headers)
+    resp.cache_control.public = True
+
+    if max_age:
+        resp.cache_control.max_age = max_age
+        resp.cache_control.stale_while_revalidate = SWR_SECONDS
+    else:
+        resp.cache_control.no_cache = True
+
+    return resp
+
+
+def not_modified(etag, max_age):
+    # If-None-Match uses weak comparison, so W/"x" from a compressed
+    # response still matches "x"
+    if request.if_none_match.contains_weak(etag):
+        return set_validators(
+            current_app.response_class(status=304), etag, max_age
+        )
+
+    return None
+
+
+def current_template_version():
+    # with auto-reload on (development) templates change under a running
+    # process, so the version is recomputed instead of trusted
+    if current_app.config["TEMPLATES_AUTO_RELOAD"]:
+        return template_version(current_app)
+
+    return current_app.config["TEMPLATE_VERSION"]
+
+
+def template_version(app):
+    digest = hashlib.sha1()
+
+    for root in (app.template_folder, app.static_folder):
+        root = os.path.join(app.root_path, root)
+
+        for dirpath, _dirs, files in sorted(os.walk(root)):
+            for name in sorted(files):
+                with open(os.path.join(dirpath, name), "rb") as fh:
+                    digest.update(fh.read())
+
+    return digest.hexdigest()[:12]
+
+# ================= RENDERED PAGES =================
+# Identical views are served without re-running Jinja. The key is the
+# page's ETag, which already covers route, city, units, upstream data
+# version and template version, so new data simply misses and the old
+# entry ages out of the LRU. Each page is kept once per encoding
+# (gzip, and brotli when available), compressed a single time on the
+# miss; the cache is bounded by total stored bytes.
+
+
+class PageVariants:
+
+    __slots__ = ("raw_size", "gzip", "br")
+
+    def __init__(self, raw):
+        self.raw_size = len(raw)
+        self.gzip = gzip.compress(raw, 6)
+        self.br = brotli.compress(raw, quality=5) if brotli else None
+
+    def __len__(self):
+        return len(self.gzip) + len(self.br or b"")
+
+    def body(self, encoding):
+        if encoding == "br":
+            return self.br
+
+        if encoding == "gzip":
+            return self.gzip
+
+        return gzip.decompress(self.gzip)
+
+
+class RenderCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._data.get(key)
+
+            if body is not None:
+                self._data.move_to_end(key)
+
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._data.pop(key, None)
+
+            if old is not None:
+                self.size -= len(old)
+
+            self._data[key] = body
+            self.size += len(body)
+
+            while self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+
+def rendered_pages():
+    limit = current_app.config["RENDER_CACHE_BYTES"]
+    return lazy("rendered_pages", lambda: RenderCache(limit))
+
+
+def page(etag, max_age, render):
+    hit = not_modified(etag, max_age)
+
+    if hit is not None:
+        return hit
+
+    cache = rendered_pages()
+    entry = cache.get(etag)
+
+    if entry is None:
+        raw = render().encode()
+        entry = PageVariants(raw)
+        cache.set(etag, entry)
+
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    body = entry.body(encoding)
+
+    resp = current_app.response_class(body, mimetype="text/html")
+    resp.vary.add("Accept-Encoding")
+
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+        compression_stats.record(entry.raw_size, len(body))
+
+    return set_validators(resp, etag, max_age)
+
+# ================= STREAMED PAGES =================
+# With a cold cache the weather pages are streamed: head, stylesheets
+# and page chrome go out before upstream is asked for anything, and the
+# data sections follow once it answers. Template values that need
+# upstream are Deferred and resolve on first use; the template marks
+# the end of the shell with {{ flush }}. Only cities already resolved
+# once are streamed. Warm requests keep going through page() with
+# validators and the render cache.
+
+FLUSH = "\x00flush\x00"
+TIMING_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+STREAM_ERROR = (
+    '<p class="stream-error">Weather data is unavailable right now. '
+    '<a href="/">Back</a></p>\n</body>\n</html>\n'
+)
+
+# last bytes of a streamed page that rendered in full; the service
+# worker only keeps streamed pages that end with it
+STREAM_DONE = "<!-- complete -->\n"
+
+
+class Deferred:
+
+    __slots__ = ("_load", "_value", "_done")
+
+    def __init__(self, load):
+        self._load = load
+        self._value = None
+        self._done = False
+
+    def get(self):
+        if not self._done:
+            self._value = self._load()
+            self._done = True
+
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __getitem__(self, key):
+        return self.get()[key]
+
+    def __iter__(self):
+        return iter(self.get())
+
+    def __len__(self):
+        return len(self.get())
+
+    def __bool__(self):
+        return bool(self.get())
+
+    def __str__(self):
+        return str(self.get())
+
+
+def deferred_view(load, *keys):
+    # one upstream load shared by every template variable it feeds
+    view = Deferred(load)
+    return {k: Deferred(lambda k=k: view.get()[k]) for k in keys}
+
+
+class RenderTimings:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def record(self, page, mode, metric, ms):
+        with self._lock:
+            s = self._series.setdefault((page, mode, metric), {
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "buckets": [0] * (len(TIMING_BUCKETS_MS) + 1)
+            })
+
+            s["count"] += 1
+            s["total_ms"] += ms
+            s["max_ms"] = max(s["max_ms"], ms)
+
+            for i, edge in enumerate(TIMING_BUCKETS_MS):
+                if ms <= edge:
+                    s["buckets"][i] += 1
+                    break
+            else:
+                s["buckets"][-1] += 1
+
+    def snapshot(self):
+        out = {}
+
+        with self._lock:
+            for (page, mode, metric), s in sorted(self._series.items()):
+                out.setdefault(page, {}).setdefault(mode, {})[metric] = {
+                    "count": s["count"],
+                    "avg_ms": round(s["total_ms"] / s["count"], 1),
+                    "max_ms": round(s["max_ms"], 1),
+                    "buckets_ms": dict(zip(
+                        [f"le_{edge}" for edge in TIMING_BUCKETS_MS] + ["inf"],
+                        s["buckets"]
+                    ))
+                }
+
+        return out
+
+
+render_timings = RenderTimings()
+
+
+@bp.app_context_processor
+def _stream_defaults():
+    return {"flush": "", "streamed": False}
+
+
+def streams(city):
+    # a streamed page sends its 200 before the data is loaded, so only
+    # names OWM has already resolved take that path; anything else is
+    # buffered and fails with its real status
+    return (
+        current_app.config["STREAM_PAGES"]
+        and city_ids.get(city.strip().lower()) is not None
+    )
+
+
+def stream_page(name, page_name, context):
+    started = time.perf_counter()
+
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_template(name)
+
+    context = dict(context, flush=FLUSH, streamed=True)
+    app.update_template_context(context)
+
+    @stream_with_context
+    def generate():
+        first = None
+        buf = []
+
+        try:
+            for chunk in template.generate(**context):
+                shell, marker, rest = chunk.partition(FLUSH)
+                buf.append(shell)
+
+                if marker:
+                    first = time.perf_counter()
+                    yield "".join(buf)
+                    buf = [rest]
+
+            yield "".join(buf) + STREAM_DONE
+        except Exception:
+            # the status line is long gone; close the page instead
+            logger.exception("streaming %s failed", name)
+            yield "".join(buf) + STREAM_ERROR
+
+        done = time.perf_counter()
+
+        render_timings.record(
+            page_name, "stream", "server_first_byte",
+            ((first or done) - started) * 1000
+        )
+        render_timings.record(
+            page_name, "stream", "server_total", (done - started) * 1000
+        )
+
+    resp = current_app.response_class(generate(), mimetype="text/html")
+    resp.cache_control.no_cache = True
+    # proxies must pass the shell on instead of buffering the response
+    resp.headers["X-Accel-Buffering"] = "no"
+    resp.headers["X-Streamed"] = "1"
+
+    return resp
+
+# ================= STATIC FILES =================
+# create_app() installs serve_static as the static view: it prefers the
+# .br/.gz siblings written at deploy time and marks fingerprinted
+# files immutable.
+
+def serve_static(filename):
+    # the built-in static view, preferring precompressed siblings
+    accept = parse_accept_header(request.headers.get("Accept-Encoding", ""))
+    path = safe_join(current_app.static_folder, filename)
+
+    for enc, ext in (("br", ".br"), ("gzip", ".gz")):
+        if path and accept[enc] and os.path.isfile(path + ext):
+            resp = current_app.send_static_file(filename + ext)
+            resp.mimetype = (
+                mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            )
+            resp.headers["Content-Encoding"] = enc
+            break
+    else:
+        resp = current_app.send_static_file(filename)
+
+    resp.vary.add("Accept-Encoding")
+
+    # a fingerprinted name never changes content
+    if (
+        filename.startswith((ASSET_DIR + "/", BACKGROUND_DIR + "/"))
+        and not filename.endswith((ASSET_MANIFEST, BACKGROUND_MANIFEST))
+        and resp.status_code == 200
+    ):
+        resp.cache_control.no_cache = None
+        resp.cache_control.public = True
+        resp.cache_control.max_age = IMMUTABLE_MAX_AGE
+        resp.cache_control.immutable = True
+
+    return resp
+
+# ================= SERVICE WORKER =================
+# /sw.js is rendered so it can precache the current (fingerprinted)
+# shell assets; its version follows the template/asset version, which
+# makes browsers install a new worker and drop old caches on deploy.
+
+SW_SHELL = (
+    "css/main.css", "js/main.js",
+    "css/today.css", "js/today.js",
+    "css/hourly.css", "js/hourly.js",
+    "css/daily.css", "js/daily.js",
+    "js/util.js", "css/tabs.css", "js/tabs.js", "js/timing.js",
+    "js/map.js", "vendor/leaflet/leaflet.js", "vendor/leaflet/leaflet.css",
+    "manifest.json",
+    "images/launchericon-192x192.png",
+    "images/launchericon-512x512.png"
+)
+SW_PAGE_LIMIT = 30
+
+
+@bp.route("/sw.js")
+def service_worker():
+
+    precache = [url_for("static", filename=f) for f in SW_SHELL]
+    version = make_etag(
+        "sw", current_app.config["TEMPLATE_VERSION"], *precache
+    )[:12]
+
+    resp = current_app.response_class(
+        render_template(
+            "sw.js",
+            version=version,
+            precache=precache,
+            page_limit=SW_PAGE_LIMIT,
+            stream_done=STREAM_DONE.strip()
+        ),
+        mimetype="application/javascript"
+    )
+
+    # browsers must always see a new worker as soon as it is deployed
+    resp.cache_control.no_cache = True
+    resp.set_etag(version)
+
+    return resp.make_conditional(request)
+
+# ================= OBSERVATION STORE =================
+# Every upstream current/forecast response lands in a time-series
+# collection (timeField "ts", metaField "city_id"). OWM refreshes its
+# observations roughly every 10 minutes, so the same (city, dt) comes
+# back many times; those repeats are dropped before they reach Mongo.
+# Writes run on the Mongo loop, off the request path; a key only
+# counts as seen once its write has landed, so a failed one is retried
+# by the next fetch.
+
+OBS_SEEN_MAX = 5000
+
+_obs_lock = threading.Lock()
+_obs_ready = False
+_obs_seen = OrderedDict()
+# key -> Future of the write in flight
+_obs_pending = {}
+
+
+async def _ensure_observation_store(db):
+    global _obs_ready
+
+    # only ever awaited on the Mongo loop thread, so no lock is needed
+    if _obs_ready:
+        return
+
+    for name in ("observations", "forecasts"):
+        try:
+            await db.create_collection(
+                name,
+                timeseries={
+                    "timeField": "ts",
+                    "metaField": "city_id",
+                    "granularity": "minutes"
+                }
+            )
+        except CollectionInvalid:
+            pass
+
+        await db[name].create_index([("city_id", 1), ("ts", -1)])
+
+    _obs_ready = True
+
+
+def _claim(key):
+    # False when the key is already stored or its write is in flight
+    with _obs_lock:
+        if key in _obs_seen:
+            _obs_seen.move_to_end(key)
+            return False
+
+        if key in _obs_pending:
+            return False
+
+        _obs_pending[key] = None
+        return True
+
+
+def _write_observation(key, coro, what):
+
+    def done(fut):
+        failed = fut.cancelled() or fut.exception() is not None
+
+        with _obs_lock:
+            _obs_pending.pop(key, None)
+
+            if not failed:
+                _obs_seen[key] = True
+
+                if len(_obs_seen) > OBS_SEEN_MAX:
+                    _obs_seen.popitem(last=False)
+
+        if failed:
+            log_failure(what)(fut)
+
+    fut = on_mongo(coro)
+
+    with _obs_lock:
+        _obs_pending[key] = fut
+
+    fut.add_done_callback(done)
+    return fut
+
+
+def observation_landed(js):
+    # True, False, or the Future of the write still in flight
+    key = ("current", js["id"], js["dt"])
+
+    with _obs_lock:
+        if key in _obs_seen:
+            return True
+
+        return _obs_pending.get(key) or False
+
+
+async def _insert_current(db, doc):
+    await _ensure_observation_store(db)
+
+    # time-series collections cannot carry a unique index, so a fresh
+    # process checks the (city_id, ts) index before writing. Check and
+    # insert are not atomic: two workers fetching the same new
+    # observation at once can both store it, and aggregates then weigh
+    # that slot twice. The seen-set keeps it to once per worker.
+    if await db.observations.find_one(
+        {"city_id": doc["city_id"], "ts": doc["ts"]}, {"_id": 1}
+    ):
+        return
+
+    await db.observations.insert_one(doc)
+
+
+async def _insert_forecast(db, docs):
+    await _ensure_observation_store(db)
+
+    first = docs[0]
+
+    # a run's first slot is valid at the run time itself, so the
+    # (city_id, ts) index finds it; the same cross-worker race as above
+    # applies
+    if await db.forecasts.find_one(
+        {"city_id": first["city_id"], "ts": first["run"], "run": first["run"]},
+        {"_id": 1}
+    ):
+        return
+
+    await db.forecasts.insert_many(docs, ordered=False)
+
+
+def record_current(js):
+    key = ("current", js["id"], js["dt"])
+
+    if not _claim(key):
+        return None
+
+    doc = {
+        "ts": _dt.utcfromtimestamp(js["dt"]),
+        "city_id": js["id"],
+        "city": js["name"],
+        "coord": js.get("coord"),
+        "temp": js["main"]["temp"],
+        "temp_min": js["main"]["temp_min"],
+        "temp_max": js["main"]["temp_max"],
+        "humidity": js["main"]["humidity"],
+        "pressure": js["main"].get("pressure"),
+        "wind_speed": js.get("wind", {}).get("speed"),
+        "weather_id": js["weather"][0]["id"],
+        "main": js["weather"][0]["main"],
+        "description": js["weather"][0]["description"],
+        "fetched": datetime.utcnow()
+    }
+
+    return _write_observation(
+        key, _insert_current(async_db(), doc), "observation write"
+    )
+
+
+def record_forecast(js):
+    city_id = js["city"]["id"]
+
+    # a forecast run is identified by its first slot
+    run = js["list"][0]["dt"]
+    key = ("forecast", city_id, run)
+
+    if not _claim(key):
+        return None
+
+    run_ts = _dt.utcfromtimestamp(run)
+    fetched = datetime.utcnow()
+
+    docs = [
+        {
+            "ts": _dt.utcfromtimestamp(it["dt"]),
+            "city_id": city_id,
+            "city": js["city"]["name"],
+            "run": run_ts,
+            "fetched": fetched,
+            "temp": it["main"]["temp"],
+            "humidity": it["main"]["humidity"],
+            "weather_id": it["weather"][0]["id"],
+            "main": it["weather"][0]["main"],
+            "description": it["weather"][0]["description"]
+        }
+        for it in js["list"]
+    ]
+
+    return _write_observation(
+        key, _insert_forecast(async_db(), docs), "forecast write"
+    )
+
+# ================= UPSTREAM =================
+OWM_URL = "https://api.openweathermap.org/data/2.5"
+
+# searched name (lower-cased) -> OWM city id
+city_ids = TTLCache(maxsize=5000, ttl=86400)
+
+# names OWM answered 404 for
+unknown_cities = TTLCache(maxsize=5000, ttl=3600)
+
+
+def remember_city(city, city_id):
+    city_ids.set(city.strip().lower(), city_id)
+
+
+# OWM publishes a new current observation about every 10 minutes
+OBS_INTERVAL = 600
+MIN_FRESH = 30
+
+current_cache = TTLCache(maxsize=1024, ttl=OBS_INTERVAL)
+
+
+def freshness(js):
+    return max(int(js["dt"] + OBS_INTERVAL - time.time()), MIN_FRESH)
+
+
+def get_current(city):
+    js = current_cache.get(city.strip().lower())
+
+    if js is None:
+        r = fetch_current(city)
+        r.raise_for_status()
+        js = r.json()
+
+    return js
+
+
+def fetch_current(city):
+    r = http().get(
+        f"{OWM_URL}/weather",
+        params={
+            "q": city,
+            "appid": current_app.config["OWM_API_KEY"],
+            "units": "metric"
+        },
+        timeout=8
+    )
+
+    if r.status_code == 200:
+        js = r.json()
+        remember_city(city, js["id"])
+        remember_city(js["name"], js["id"])
+        record_current(js)
+        current_cache.set(city.strip().lower(), js, ttl=freshness(js))
+
+    return r
+
+
+def fetch_forecast(city):
+    r = http().get(
+        f"{OWM_URL}/forecast",
+        params={
+            "q": city,
+            "appid": current_app.config["OWM_API_KEY"],
+            "units": "metric"
+        },
+        timeout=8
+    )
+
+    if r.status_code == 200:
+        js = r.json()
+        remember_city(city, js["city"]["id"])
+        record_forecast(js)
+
+    return r
+
+# ================= ICON =================
+def weather_icon(main, desc, dt=None, sunrise=None, sunset=None):
+    main = (main or "").lower()
+    desc = (desc or "").lower()
+
+    if "thunder" in main or "thunder" in desc:
+        return "⛈️"
+    if "snow" in main:
+        return "❄️"
+    if "rain" in main or "drizzle" in desc:
+        return "🌧️"
+    if "cloud" in main:
+        return "☁️"
+    if "mist" in main or "fog" in main or "haze" in main:
+        return "🌫️"
+
+    return "☀️"
+
+# ================= HOME =================
+HOME_MAX_AGE = 300
+
+
+@bp.route("/")
+def home():
+    return page(
+        make_etag("home"),
+        HOME_MAX_AGE,
+        lambda: render_template("main.html")
+    )
+
+# ================= WEATHER SEARCH =================
+@bp.route("/api/weather", methods=["POST"])
+def api_weather():
+
+    city = request.json.get("city", "").strip()
+
+    if not city:
+        return jsonify({"error": "City required"}), 400
+
+    r = fetch_current(city)
+
+    if r.status_code != 200:
+        return jsonify({"error": "City not found"}), 404
+
+    js = r.json()
+
+    # the history write runs on the Mongo loop while this response (and
+    # the browser's follow-up page fetch) is already on its way. The
+    # event points at the observation fetch_current stored once per
+    # (city_id, dt), and is written after it.
+    pending = on_mongo(insert_search(
+        history_writes(async_db()),
+        observation_landed(js),
+        {
+            "temp": js["main"]["temp"],
+            "main": js["weather"][0]["main"],
+            "description": js["weather"][0]["description"]
+        },
+        {
+            "city": city,
+            "city_id": js["id"],
+            "obs_dt": _dt.utcfromtimestamp(js["dt"]),
+            "location": {
+            "type": "Point",
+                "coordinates": [js["coord"]["lon"], js["coord"]["lat"]]
+            },
+            "dt": datetime.utcnow()
+        }
+    ))
+    pending.add_done_callback(history_written(
+        current_app._get_current_object()
+    ))
+
+    return jsonify({
+        "redirect": url_for(".today", city=city)
+    })
+
+
+async def insert_search(history, landed, seen, doc):
+    # only when the observation could not be stored does the event keep
+    # the few fields history needs to show it
+    await ensure_history_indexes(history.database)
+
+    if isinstance(landed, Future):
+        write = asyncio.wrap_future(landed)
+        await asyncio.wait([write])
+        landed = not write.cancelled() and write.exception() is None
+
+    if not landed:
+        doc = {**doc, "seen": seen}
+
+    await history.insert_one(doc)
+
+
+def history_written(app):
+    # runs on the Mongo loop; until the insert lands, a cleared cache
+    # would only be refilled with the old list
+    def done(fut):
+        if fut.cancelled() or fut.exception() is not None:
+            log_failure("history write")(fut)
+            return
+
+        history_cache.clear()
+
+        with app.app_context():
+            announce_write("weather")
+
+    return done
+
+# ================= TODAY =================
+@bp.route("/weather/<city>/today")
+def today(city):
+
+    js = current_cache.get(city.strip().lower())
+
+    if js is None and streams(city):
+
+        def load():
+            js = get_current(city)
+            note_city(js["name"])
+            return today_view(city, js)
+
+        return stream_page("today.html", "today", {
+            "city": city,
+            **deferred_view(
+                load, "data", "sunrise", "sunset", "weather_main"
+            )
+        })
+
+    js = js or get_current(city)
+    note_city(js["name"])
+
+    return page(
+        make_etag("today", city, js["id"], js["dt"]),
+        freshness(js),
+        lambda: render_today(city, js)
+    )
+
+
+def render_today(city, js):
+    return render_template("today.html", **today_view(city, js))
+
+
+def today_view(city, js):
+
+    sunrise = js["sys"]["sunrise"]
+    sunset = js["sys"]["sunset"]
+
+    data = {
+        "city": city,
+        "temp": round(js["main"]["temp"]),
+        "today_high": round(js["main"]["temp_max"]),
+        "today_low": round(js["main"]["temp_min"]),
+        "main": js["weather"][0]["main"],
+        "desc": js["weather"][0]["description"],
+        "icon": weather_icon(
+            js["weather"][0]["main"],
+            js["weather"][0]["description"]
+        ),
+        "dt": datetime.now().strftime("%d %b %Y, %I:%M %p")
+    }
+
+    return {
+        "city": city,
+        "data": data,
+        "sunrise": sunrise,
+        "sunset": sunset,
+        "weather_main": data["main"]
+    }
+
+# ================= WEATHER CITY =================
+@bp.route("/weather/<city>")
+def weather_city(city):
+    return redirect(url_for(".today", city=city))
+
+# ================= HISTORY =================
+NEAR_MAX_KM = 2000
+NEAR_WINDOW = timedelta(days=1)
+NEAR_LIMIT = 20
+
+HISTORY_INDEX_RETRY_S = 60
+
+_history_indexed = False
+_history_index_retry = 0.0
+
+
+async def ensure_history_indexes(db):
+    global _history_indexed, _history_index_retry
+
+    # only ever awaited on the Mongo loop thread; after a failure the
+    # build is tried again at most once per HISTORY_INDEX_RETRY_S
+    if _history_indexed or time.monotonic() < _history_index_retry:
+        return
+
+    try:
+        await db.weather.create_index([("dt", -1), ("_id", -1)])
+        await db.weather.create_index([("location", "2dsphere")])
+    except PyMongoError:
+        _history_index_retry = time.monotonic() + HISTORY_INDEX_RETRY_S
+        logger.exception("history index build failed")
+        return
+
+    _history_indexed = True
+
+
+async def with_history_indexes(db, coro):
+    await ensure_history_indexes(db)
+    return await coro
+
+
+OBSERVATION_FIELDS = {
+    "_id": 0, "city_id": 1, "ts": 1, "temp": 1, "main": 1, "description": 1
+}
+
+
+def observation_query(docs):
+    # older records still carry their own values; newer search events
+    # are joined to the observation they saw
+    keys = {
+        (d["city_id"], d["obs_dt"])
+        for d in docs
+        if "temperature" not in d
+    }
+
+    if not keys:
+        return None
+
+    return {"$or": [{"city_id": c, "ts": t} for c, t in keys]}
+
+
+def join_observations(docs, found):
+    found = {(o["city_id"], o["ts"]): o for o in found}
+    out = []
+
+    for d in docs:
+        if "temperature" not in d:
+            o = found.get((d["city_id"], d["obs_dt"])) or d.get("seen")
+
+            if o is None:
+                continue
+
+            d = {
+                **d,
+                "temperature": o["temp"],
+                "main": o["main"],
+                "description": o["description"]
+            }
+
+        out.append(d)
+
+    return out
+
+
+async def with_observations(observations, docs):
+    query = observation_query(docs)
+    found = []
+
+    if query is not None:
+        found = await observations.find(query, OBSERVATION_FIELDS).to_list()
+
+    return join_observations(docs, found)
+
+
+async def recent_history(history, observations, limit):
+    docs = await (
+        history.find({}, {"_id": 0})
+        .sort("dt", -1)
+        .limit(limit)
+        .to_list()
+    )
+    return await with_observations(observations, docs)
+
+
+def log_failure(what):
+
+    def callback(fut):
+        if not fut.cancelled() and fut.exception() is not None:
+            logger.error("%s failed", what, exc_info=fut.exception())
+
+    return callback
+
+
+history_cache = TTLCache(maxsize=4, ttl=30)
+
+HISTORY_PAGE_MAX = 200
+
+
+def history_items(docs):
+    return [
+        {
+            "city": d["city"],
+            "temperature": d["temperature"],
+            "icon": weather_icon(d["main"], d["description"]),
+            "dt": d["dt"].strftime("%d-%b-%Y %I:%M %p")
+        }
+        for d in docs
+    ]
+
+
+def parse_dt(value):
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return dt
+
+
+def parse_cursor(value):
+    # "<dt>,<_id>" from X-Next-Before; a bare dt is still accepted
+    dt, _, oid = value.partition(",")
+    dt = parse_dt(dt)
+
+    if dt is None or not oid:
+        return dt, None
+
+    try:
+        return dt, ObjectId(oid)
+    except InvalidId:
+        return None, None
+
+
+def before_query(dt, oid):
+    if oid is None:
+        return {"dt": {"$lt": dt}}
+
+    return {"$or": [
+        {"dt": {"$lt": dt}},
+        {"dt": dt, "_id": {"$lt": oid}}
+    ]}
+
+
+@bp.route("/api/history")
+def api_history():
+
+    if "before" not in request.args and "limit" not in request.args:
+        items = history_cache.get("recent")
+
+        if items is None:
+            db = async_db()
+
+            items = history_items(run_mongo(
+                recent_history(history_reads(db), db.observations, 6)
+            ))
+
+            history_cache.set("recent", items)
+
+        # searches land at any moment: revalidate every time, but let
+        # the ETag turn an unchanged list into an empty 304
+        body = json.dumps(items)
+        etag = make_etag("history", body)
+
+        return not_modified(etag, 0) or set_validators(
+            current_app.response_class(body, mimetype="application/json"),
+            etag,
+            0
+        )
+
+    # keyset pagination on (dt, _id): each page starts strictly below the
+    # last row of the previous one, so deep pages cost the same as the
+    # first and events sharing a dt are neither skipped nor repeated
+    before = None
+
+    if "before" in request.args:
+        before = parse_cursor(request.args["before"])
+
+        if before[0] is None:
+            return jsonify({"error": "Bad before"}), 400
+
+    limit = request.args.get("limit", 6, type=int) or 6
+    limit = min(max(limit, 1), HISTORY_PAGE_MAX)
+
+    db = async_db()
+
+    # the raw page decides the next cursor, even if some events are
+    # dropped for lack of an observation
+    docs = run_mongo(
+        history_reads(db).find(before_query(*before) if before else {})
+        .sort([("dt", -1), ("_id", -1)])
+        .limit(limit)
+        .to_list()
+    )
+
+    resp = jsonify(history_items(
+        run_mongo(with_observations(db.observations, docs))
+    ))
+
+    if len(docs) == limit:
+        last = docs[-1]
+        resp.headers["X-Next-Before"] = (
+            f"{last['dt'].isoformat()}Z,{last['_id']}"
+        )
+
+    return resp
+
+
+EXPORT_BATCH = 1000
+EXPORT_FIELDS = (
+    "dt", "city", "city_id", "obs_dt", "lat", "lon",
+    "temperature", "main", "description"
+)
+
+
+def export_rows(since, until):
+    db = get_db()
+
+    query = {}
+
+    if since or until:
+        query["dt"] = {}
+
+        if since:
+            query["dt"]["$gte"] = since
+        if until:
+            query["dt"]["$lt"] = until
+
+    cursor = (
+        history_reads()
+        .find(query, {"_id": 0})
+        .sort("dt", 1)
+        .batch_size(EXPORT_BATCH)
+    )
+
+    # join observations one cursor batch at a time; only a single batch
+    # is ever held in memory
+    batch = []
+
+    for doc in cursor:
+        batch.append(doc)
+
+        if len(batch) == EXPORT_BATCH:
+            yield from _export_batch(db, batch)
+            batch = []
+
+    if batch:
+        yield from _export_batch(db, batch)
+
+
+def _export_batch(db, docs):
+    query = observation_query(docs)
+    found = db.observations.find(query, OBSERVATION_FIELDS) if query else []
+
+    for d in join_observations(docs, found):
+        coords = (d.get("location") or {}).get("coordinates") or [None, None]
+
+        yield {
+            "dt": d["dt"].isoformat() + "Z",
+            "city": d["city"],
+            "city_id": d.get("city_id"),
+            "obs_dt": d["obs_dt"].isoformat() + "Z" if d.get("obs_dt") else None,
+            "lat": coords[1],
+            "lon": coords[0],
+            "temperature": d["temperature"],
+            "main": d["main"],
+            "description": d["description"]
+        }
+
+
+def _ndjson(rows):
+    lines = []
+
+    for row in rows:
+        lines.append(json.dumps(row))
+
+        if len(lines) == EXPORT_BATCH:
+            yield "\n".join(lines) + "\n"
+            lines = []
+
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def _csv(rows):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+
+    for n, row in enumerate(rows, 1):
+        writer.writerow(row)
+
+        if n % EXPORT_BATCH == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    yield buf.getvalue()
+
+
+@bp.route("/api/history/export")
+def api_history_export():
+
+    fmt = request.args.get("format", "ndjson")
+
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+
+    since = until = None
+
+    if "since" in request.args:
+        since = parse_dt(request.args["since"])
+    if "until" in request.args:
+        until = parse_dt(request.args["until"])
+
+    if ("since" in request.args and since is None) or (
+        "until" in request.args and until is None
+    ):
+        return jsonify({"error": "Bad since/until"}), 400
+
+    rows = export_rows(since, until)
+
+    if fmt == "csv":
+        body, mimetype = _csv(rows), "text/csv"
+    else:
+        body, mimetype = _ndjson(rows), "application/x-ndjson"
+
+    resp = current_app.response_class(
+        stream_with_context(body),
+        mimetype=mimetype
+    )
+    resp.headers["Content-Disposition"] = (
+        f"attachment; filename=history.{fmt}"
+    )
+
+    return resp
+
+@bp.route("/api/history/near")
+def api_history_near():
+
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    km = request.args.get("km", 50, type=float)
+
+    if lat is None or lon is None:
+        return jsonify({"error": "lat and lon required"}), 400
+
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        return jsonify({"error": "lat/lon out of range"}), 400
+
+    km = min(max(km, 0.1), NEAR_MAX_KM)
+
+    # $geoNear must open the pipeline and is served by the 2dsphere
+    # index; the query narrows it to recent searches, then repeats of
+    # one city collapse to their latest record
+    db = async_db()
+
+    docs = run_mongo(with_history_indexes(db, aggregate_list(
+        history_reads(db),
+        [
+            {"$geoNear": {
+                "near": {"type": "Point", "coordinates": [lon, lat]},
+                "distanceField": "distance",
+                "maxDistance": km * 1000,
+                "spherical": True,
+                "query": {"dt": {"$gte": datetime.utcnow() - NEAR_WINDOW}}
+            }},
+            {"$sort": {"dt": -1}},
+            {"$group": {
+                "_id": {"$toLower": "$city"},
+                "doc": {"$first": "$$ROOT"}
+            }},
+            {"$replaceWith": "$doc"},
+            {"$sort": {"distance": 1}},
+            {"$limit": NEAR_LIMIT},
+            {"$project": {"_id": 0}}
+        ],
+        then=lambda docs: with_observations(db.observations, docs)
+    )))
+
+    return jsonify([
+        {
+            "city": d["city"],
+            "temperature": d["temperature"],
+            "icon": weather_icon(d["main"], d["description"]),
+            "lat": d["location"]["coordinates"][1],
+            "lon": d["location"]["coordinates"][0],
+            "km": round(d["distance"] / 1000, 1),
+            "dt": d["dt"].strftime("%d-%b-%Y %I:%M %p")
+        }
+        for d in docs
+    ])
+
+# ================= FORECAST MODEL =================
+# The 40 forecast slots are parsed once into NumPy columns and cached
+# per city; hourly and daily views are slices and reductions over them.
+# Slots are grouped by the city's local calendar day (city.timezone),
+# not by the UTC date in dt_txt.
+
+FORECAST_TTL = 600
+
+forecast_cache = TTLCache(maxsize=512, ttl=FORECAST_TTL)
+
+
+def _day_mode(labels, day_idx, days):
+    # most frequent label per day from a (day x label) table; ties go to
+    # the label seen first that day, like Counter.most_common
+    n = len(labels)
+    shape = (days, int(labels.max()) + 1)
+
+    counts = np.zeros(shape, np.int64)
+    np.add.at(counts, (day_idx, labels), 1)
+
+    first = np.full(shape, n, np.int64)
+    np.minimum.at(first, (day_idx, labels), np.arange(n))
+
+    return (counts * (n + 1) - first).argmax(axis=1)
+
+
+class ForecastModel:
+
+    __slots__ = (
+        "city_id", "name", "tz", "dt", "local_day", "temp", "humidity",
+        "cond", "conditions", "version", "expires"
+    )
+
+    def __init__(self, js):
+        items = js["list"]
+        n = len(items)
+
+        self.city_id = js["city"]["id"]
+        self.name = js["city"]["name"]
+        self.tz = js["city"]["timezone"]
+        self.expires = time.time() + FORECAST_TTL
+
+        self.dt = np.fromiter((it["dt"] for it in items), np.int64, n)
+        self.temp = np.fromiter(
+            (it["main"]["temp"] for it in items), np.float64, n
+        )
+        self.humidity = np.fromiter(
+            (it["main"]["humidity"] for it in items), np.int16, n
+        )
+        self.cond = np.fromiter(
+            (it["weather"][0]["id"] for it in items), np.int16, n
+        )
+        self.local_day = (self.dt + self.tz) // 86400
+
+        # the forecast carries no issue time; its content is the version
+        self.version = hashlib.sha1(
+            self.dt.tobytes() + self.temp.tobytes() + self.cond.tobytes()
+        ).hexdigest()[:16]
+
+        # an OWM condition id fixes both main and description
+        self.conditions = {
+            it["weather"][0]["id"]: (
+                it["weather"][0]["main"],
+                it["weather"][0]["description"]
+            )
+            for it in items
+        }
+
+    def condition(self, i):
+        return self.conditions[int(self.cond[i])]
+
+    def freshness(self):
+        return max(int(self.expires - time.time()), MIN_FRESH)
+
+    def hours(self, count):
+        rows = []
+
+        for i in range(min(count, len(self.dt))):
+            local_time = _dt.utcfromtimestamp(int(self.dt[i]) + self.tz)
+            main, desc = self.condition(i)
+
+            rows.append({
+                "time": local_time.strftime("%I:%M %p").lstrip("0"),
+                "temp": round(float(self.temp[i])),
+                "humidity": int(self.humidity[i]),
+                "icon": weather_icon(main, desc),
+                "is_now": False
+            })
+
+        return rows
+
+    def days(self, count):
+        # slots are in time order, so each local day is one contiguous run
+        starts = np.flatnonzero(
+            np.r_[True, self.local_day[1:] != self.local_day[:-1]]
+        )[:count]
+        stop = starts[-1] + np.count_nonzero(
+            self.local_day == self.local_day[starts[-1]]
+        )
+
+        hi = np.maximum.reduceat(self.temp[:stop], starts)
+        lo = np.minimum.reduceat(self.temp[:stop], starts)
+
+        # main and description are each the day's most frequent value,
+        # counted separately as the per-day Counters used to
+        codes, cond_idx = np.unique(self.cond[:stop], return_inverse=True)
+        day_idx = np.repeat(
+            np.arange(len(starts)), np.diff(np.r_[starts, stop])
+        )
+
+        mains, main_of = np.unique(
+            [self.conditions[int(c)][0] for c in codes], return_inverse=True
+        )
+        descs, desc_of = np.unique(
+            [self.conditions[int(c)][1] for c in codes], return_inverse=True
+        )
+
+        main_mode = mains[_day_mode(main_of[cond_idx], day_idx, len(starts))]
+        desc_mode = descs[_day_mode(desc_of[cond_idx], day_idx, len(starts))]
+
+        rows = []
+
+        for day, h, l, main, desc in zip(
+            self.local_day[starts], hi, lo, main_mode, desc_mode
+        ):
+            date = _dt.utcfromtimestamp(int(day) * 86400)
+            main, desc = str(main), str(desc)
+
+            rows.append({
+                "label": date.strftime("%a").upper(),
+                "date": date.strftime("%m/%d"),
+                "icon": weather_icon(main, desc),
+                "hi": round(float(h)),
+                "lo": round(float(l)),
+                "desc": desc.capitalize()
+            })
+
+        return rows
+
+
+def get_forecast(city):
+    key = city.strip().lower()
+    model = forecast_cache.get(key)
+
+    if model is None:
+        r = fetch_forecast(city)
+        r.raise_for_status()
+
+        model = ForecastModel(r.json())
+        forecast_cache.set(key, model)
+
+    return model
+
+# ================= HOURLY =================
+@bp.route("/weather/<city>/hourly")
+def hourly(city):
+
+    key = city.strip().lower()
+
+    if streams(city) and (
+        current_cache.get(key) is None or forecast_cache.get(key) is None
+    ):
+
+        def load():
+            current_js = get_current(city)
+            note_city(current_js["name"])
+            return hourly_view(city, current_js, get_forecast(city))
+
+        return stream_page("hourly.html", "hourly", {
+            "city": city,
+            **deferred_view(load, "hourly", "weather_main")
+        })
+
+    # current weather (for NOW)
+    current_js = get_current(city)
+    note_city(current_js["name"])
+
+    forecast = get_forecast(city)
+
+    return page(
+        make_etag(
+            "hourly", city, current_js["id"], current_js["dt"],
+            forecast.version
+        ),
+        min(freshness(current_js), forecast.freshness()),
+        lambda: render_hourly(city, current_js, forecast)
+    )
+
+
+def render_hourly(city, current_js, forecast):
+    return render_template(
+        "hourly.html", **hourly_view(city, current_js, forecast)
+    )
+
+
+def hourly_view(city, current_js, forecast):
+
+    hourly_data = []
+    # add NOW manually
+    hourly_data.append({
+        "time": "NOW",
+        "temp": round(current_js["main"]["temp"]),
+        "humidity": current_js["main"]["humidity"],
+        "icon": weather_icon(
+            current_js["weather"][0]["main"],
+            current_js["weather"][0]["description"]
+        ),
+        "is_now": True
+    })
+
+    # forecast hours
+    hourly_data.extend(forecast.hours(11))
+
+    current_weather = current_js["weather"][0]["main"]
+
+    return {
+        "city": city,
+        "hourly": hourly_data,
+        "weather_main": current_weather
+    }
+
+# ================= DAILY =================
+@bp.route("/weather/<city>/daily")
+def daily(city):
+
+    if streams(city) and forecast_cache.get(city.strip().lower()) is None:
+
+        def load():
+            forecast = get_forecast(city)
+            note_city(forecast.name)
+            return daily_view(city, forecast)
+
+        return stream_page("daily.html", "daily", {
+            "city": city,
+            **deferred_view(load, "days", "weather_main")
+        })
+
+    forecast = get_forecast(city)
+    note_city(forecast.name)
+
+    return page(
+        make_etag("daily", city, forecast.version),
+        forecast.freshness(),
+        lambda: render_daily(city, forecast)
+    )
+
+
+def render_daily(city, forecast):
+    return render_template("daily.html", **daily_view(city, forecast))
+
+
+def daily_view(city, forecast):
+
+    # ⭐ get current weather for background
+    current_weather = forecast.condition(0)[0]
+
+    return {
+        "city": city,
+        "days": forecast.days(5),
+        "weather_main": current_weather
+    }
+
+# ================= BUNDLE =================
+# Everything the today/hourly/daily pages show, from one current and
+# one forecast lookup. The pages fetch it once and switch between the
+# three views client-side; it is validated like the pages themselves.
+
+@bp.route("/api/city/<city>/bundle")
+def api_city_bundle(city):
+
+    js = get_current(city)
+    forecast = get_forecast(city)
+
+    etag = make_etag("bundle", city, js["id"], js["dt"], forecast.version)
+    max_age = min(freshness(js), forecast.freshness())
+
+    hit = not_modified(etag, max_age)
+
+    if hit is not None:
+        return hit
+
+    body = json.dumps({
+        "city": city,
+        "today": today_view(city, js),
+        "hourly": hourly_view(city, js, forecast),
+        "daily": daily_view(city, forecast)
+    })
+
+    resp = current_app.response_class(body, mimetype="application/json")
+    return set_validators(resp, etag, max_age)
+
+# ================= TREND =================
+# Charts never see raw observations: the range is cut into at most
+# `points` buckets with $dateTrunc and aggregated server-side.
+
+TREND_POINTS = 120
+TREND_MAX_RANGE = timedelta(days=365)
+TREND_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+
+trend_cache = TTLCache(maxsize=512, ttl=300)
+
+
+def parse_range(value):
+    m = re.fullmatch(r"(\d+)([mhd])", (value or "").strip().lower())
+
+    if not m:
+        return None
+
+    span = timedelta(**{TREND_UNITS[m.group(2)]: int(m.group(1))})
+
+    if not span or span > TREND_MAX_RANGE:
+        return None
+
+    return span
+
+
+def resolve_city_id(city):
+    # names never seen by this process are resolved through OWM, not by
+    # scanning observations; unknown names are remembered as such
+    key = city.strip().lower()
+    city_id = city_ids.get(key)
+
+    if city_id is not None:
+        return city_id
+
+    if unknown_cities.get(key):
+        return None
+
+    r = fetch_current(city)
+
+    if r.status_code == 404:
+        unknown_cities.set(key, True)
+        return None
+
+    r.raise_for_status()
+    return r.json()["id"]
+
+
+def trend_points(city_id, span, points):
+    since = datetime.utcnow() - span
+    bin_minutes = max(10, math.ceil(span.total_seconds() / 60 / points))
+
+    return [
+        {
+            "t": b["_id"].strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "temp": round(b["temp"], 1),
+            "temp_min": round(b["temp_min"], 1),
+            "temp_max": round(b["temp_max"], 1),
+            "humidity": round(b["humidity"]),
+            "n": b["n"]
+        }
+        for b in get_db().observations.aggregate([
+            {"$match": {"city_id": city_id, "ts": {"$gte": since}}},
+            {"$group": {
+                "_id": {"$dateTrunc": {
+                    "date": "$ts",
+                    "unit": "minute",
+                    "binSize": bin_minutes
+                }},
+                "temp": {"$avg": "$temp"},
+                "temp_min": {"$min": "$temp"},
+                "temp_max": {"$max": "$temp"},
+                "humidity": {"$avg": "$humidity"},
+                "n": {"$sum": 1}
+            }},
+            {"$sort": {"_id": 1}}
+        ])
+    ], bin_minutes
+
+
+@bp.route("/api/city/<city>/trend")
+def api_trend(city):
+
+    span = parse_range(request.args.get("range", "7d"))
+
+    if span is None:
+        return jsonify({"error": "Bad range"}), 400
+
+    points = request.args.get("points", TREND_POINTS, type=int)
+    points = min(max(points or TREND_POINTS, 2), 1000)
+
+    city_id = resolve_city_id(city)
+
+    if city_id is None:
+        return jsonify({"error": "No observations for city"}), 404
+
+    key = (city_id, span, points)
+    hit = trend_cache.get(key)
+
+    if hit is None:
+        series, bin_minutes = trend_points(city_id, span, points)
+
+        body = json.dumps({
+            "city_id": city_id,
+            "range": request.args.get("range", "7d"),
+            "bin_minutes": bin_minutes,
+            "points": series
+        })
 
-API_KEY = os.getenv("OWM_API_KEY")
-MONGO_URI = os.getenv("MONGO_URI")
-SECRET_KEY = os.getenv("SECRET_KEY")
+        etag = hashlib.sha1(body.encode()).hexdigest()
+        hit = (body, etag)
+        trend_cache.set(key, hit)
 
-if not API_KEY:
-    raise RuntimeError("Set OWM_API_KEY")
-if not MONGO_URI:
-    raise RuntimeError("Set MONGO_URI")
+    body, etag = hit
+    return cached_json(body, etag, trend_cache.ttl)
 
-# ================= APP =================
-app = Flask(__name__)
-app.config["TEMPLATES_AUTO_RELOAD"] = True
+# ================= TRENDING =================
+# A background job aggregates the recent search window into the small
+# trending_cities collection with $merge; /api/trending only ever reads
+# that collection. Every worker runs the loop, but a lease document in
+# `jobs` lets just one of them do the work per interval.
 
-# ================= DB =================
-client = MongoClient(MONGO_URI)
-db = client["weather_db"]
-collection = db["weather"]
+TRENDING_LIMIT = 9
 
-# ================= ICON =================
-def weather_icon(main, desc, dt=None, sunrise=None, sunset=None):
-    main = (main or "").lower()
-    desc = (desc or "").lower()
+trending_cache = TTLCache(maxsize=4, ttl=30)
 
-    if "thunder" in main or "thunder" in desc:
-        return "⛈️"
-    if "snow" in main:
-        return "❄️"
-    if "rain" in main or "drizzle" in desc:
-        return "🌧️"
-    if "cloud" in main:
-        return "☁️"
-    if "mist" in main or "fog" in main or "haze" in main:
-        return "🌫️"
 
-    return "☀️"
+def _take_lease(jobs, name, seconds):
+    now = datetime.utcnow()
 
-# ================= HOME =================
-@app.route("/")
-def home():
-    return render_template("main.html")
+    try:
+        return jobs.find_one_and_update(
+            {"_id": name, "lease_until": {"$lt": now}},
+            {"$set": {
+                "lease_until": now + timedelta(seconds=seconds),
+                "owner": os.getpid()
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        ) is not None
+    except DuplicateKeyError:
+        # another worker holds an unexpired lease
+        return False
 
-# ================= WEATHER SEARCH =================
-@app.route("/api/weather", methods=["POST"])
-def api_weather():
 
-    city = request.json.get("city", "").strip()
+def refresh_trending():
+    cfg = current_app.config
+    db = get_db()
 
-    if not city:
-        return jsonify({"error": "City required"}), 400
+    started = time.perf_counter()
+    run = datetime.utcnow()
+    window = timedelta(hours=cfg["TRENDING_WINDOW_HOURS"])
+    half_life_ms = cfg["TRENDING_HALF_LIFE_HOURS"] * 3600 * 1000
 
-    r = requests.get(
-        "https://api.openweathermap.org/data/2.5/weather",
-        params={
-            "q": city,
-            "appid": API_KEY,
-            "units": "metric"
-        },
-        timeout=8
+    db.weather.aggregate([
+        {"$match": {"dt": {"$gte": run - window}}},
+        # so $last below is the most recent spelling of each city
+        {"$sort": {"dt": 1}},
+        {"$group": {
+            "_id": {"$toLower": "$city"},
+            "city": {"$last": "$city"},
+            "searches": {"$sum": 1},
+            "last_search": {"$max": "$dt"},
+            # each search counts 1 now and halves every half-life
+            "score": {"$sum": {"$pow": [
+                0.5,
+                {"$divide": [{"$subtract": [run, "$dt"]}, half_life_ms]}
+            ]}}
+        }},
+        {"$set": {"refreshed": run}},
+        {"$merge": {
+            "into": "trending_cities",
+            "on": "_id",
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ])
+
+    # cities that fell out of the window were not touched by this run
+    db.trending_cities.delete_many({"refreshed": {"$lt": run}})
+
+    rows = db.trending_cities.count_documents({})
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    trending_cache.clear()
+    announce_write("trending_cities")
+
+    db.jobs.update_one(
+        {"_id": "trending"},
+        {"$set": {
+            "last_run": run,
+            "duration_ms": duration_ms,
+            "rows": rows
+        }}
     )
 
-    if r.status_code != 200:
-        return jsonify({"error": "City not found"}), 404
+    current_app.logger.info(
+        "trending refreshed: %d cities in %.1f ms", rows, duration_ms
+    )
 
-    js = r.json()
 
-    collection.insert_one({
-        "city": city,
-        "temperature": js["main"]["temp"],
-        "main": js["weather"][0]["main"],
-        "description": js["weather"][0]["description"],
-        "dt": datetime.utcnow()
-    })
+@background("trending")
+def trending_loop():
+    interval = current_app.config["TRENDING_INTERVAL_S"]
+
+    while True:
+        try:
+            if _take_lease(get_db().jobs, "trending", interval):
+                refresh_trending()
+        except PyMongoError:
+            current_app.logger.exception("trending refresh failed")
+
+        time.sleep(interval)
+
+
+@bp.route("/api/trending")
+def api_trending():
+
+    hit = trending_cache.get("trending")
+
+    if hit is None:
+        db = get_db()
+
+        cities = list(
+            db.trending_cities.find({}, {"_id": 0, "refreshed": 0})
+            .sort("score", -1)
+            .limit(TRENDING_LIMIT)
+        )
+
+        job = db.jobs.find_one({"_id": "trending"}) or {}
+        last_run = job.get("last_run")
+
+        body = json.dumps({
+            "cities": [
+                {
+                    "city": c["city"],
+                    "searches": c["searches"],
+                    "score": round(c["score"], 2),
+                    "last_search": c["last_search"].strftime(
+                        "%d-%b-%Y %I:%M %p"
+                    )
+                }
+                for c in cities
+            ],
+            "refreshed": (
+                last_run.strftime("%Y-%m-%dT%H:%M:%SZ") if last_run else None
+            ),
+            "job_ms": job.get("duration_ms")
+        })
+
+        hit = (body, hashlib.sha1(body.encode()).hexdigest(), last_run)
+        trending_cache.set("trending", hit)
+
+    body, etag, last_run = hit
+
+    resp = cached_json(body, etag, trending_cache.ttl)
+
+    if last_run is not None:
+        resp.headers["X-Data-Age"] = str(
+            int((datetime.utcnow() - last_run).total_seconds())
+        )
+
+    return resp
+
+# ================= LIVE POPULARITY =================
+# Space-saving top-K over city names with forward exponential decay:
+# a hit at time t weighs 2^((t - landmark) / half_life), so older hits
+# fade without touching every counter. Memory is K counters no matter
+# how many distinct cities are seen. Workers publish their sketch to
+# Mongo every few seconds and merge everyone's into one live view.
+
+
+class SpaceSaving:
+
+    def __init__(self, k=64, half_life=60.0):
+        self.k = k
+        self.half_life = half_life
+        self.landmark = time.time()
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def _weight(self, now):
+        return 2 ** ((now - self.landmark) / self.half_life)
+
+    def _rescale(self, now):
+        # keep weights in float range by moving the landmark forward;
+        # after a long idle spell everything has decayed to ~0 anyway
+        factor = 2 ** min((now - self.landmark) / self.half_life, 1000)
+
+        for key, (count, err) in self.counters.items():
+            self.counters[key] = (count / factor, err / factor)
+
+        self.landmark = now
+
+    def add(self, key, now=None):
+        now = time.time() if now is None else now
+
+        with self._lock:
+            if now - self.landmark > 40 * self.half_life:
+                self._rescale(now)
+
+            w = self._weight(now)
+            hit = self.counters.get(key)
+
+            if hit is not None:
+                self.counters[key] = (hit[0] + w, hit[1])
+            elif len(self.counters) < self.k:
+                self.counters[key] = (w, 0.0)
+            else:
+                victim = min(self.counters, key=lambda c: self.counters[c][0])
+                floor = self.counters.pop(victim)[0]
+                self.counters[key] = (floor + w, floor)
+
+    def snapshot(self, now=None):
+        # (key, decayed count, max overestimate) as of `now`
+        now = time.time() if now is None else now
+
+        with self._lock:
+            if now - self.landmark > 40 * self.half_life:
+                self._rescale(now)
+
+            scale = self._weight(now)
+
+            return sorted(
+                (
+                    (key, count / scale, err / scale)
+                    for key, (count, err) in self.counters.items()
+                ),
+                key=lambda row: row[1],
+                reverse=True
+            )
+
+
+def sketch():
+    cfg = current_app.config
+
+    return lazy("sketch", lambda: SpaceSaving(
+        cfg["LIVE_TOP_K"],
+        cfg["LIVE_WINDOW_S"] / 5
+    ))
+
+
+def note_city(city):
+    # called once per page view with the name OWM resolved, never with
+    # the raw URL segment; the tabs' bundle prefetch is not counted
+    city = (city or "").strip().lower()
+
+    if city:
+        sketch().add(city)
+
+
+def merge_sketches(rows, half_life, k, now):
+    merged = defaultdict(float)
+
+    for published, counters in rows:
+        fade = 2 ** (-(now - published) / half_life)
+
+        for key, count, _err in counters:
+            merged[key] += count * fade
+
+    return sorted(merged.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+
+@background("live-popularity")
+def live_popularity_loop():
+    cfg = current_app.config
+    interval = cfg["LIVE_MERGE_INTERVAL_S"]
+    me = f"{socket.gethostname()}:{os.getpid()}"
+
+    while True:
+        time.sleep(interval)
+
+        now = time.time()
+        mine = sketch()
+
+        try:
+            col = get_db().sketches
+
+            col.replace_one(
+                {"_id": me},
+                {
+                    "ts": now,
+                    "counters": [list(row) for row in mine.snapshot(now)]
+                },
+                upsert=True
+            )
+
+            rows = [
+                (d["ts"], d["counters"])
+                for d in col.find({"ts": {"$gte": now - 3 * interval}})
+            ]
+        except PyMongoError:
+            current_app.logger.exception("sketch merge failed")
+            continue
+
+        process_state()["live_view"] = (
+            now,
+            merge_sketches(rows, mine.half_life, mine.k, now)
+        )
+
+
+@bp.route("/api/trending/live")
+def api_trending_live():
+
+    now = time.time()
+    interval = current_app.config["LIVE_MERGE_INTERVAL_S"]
+    view = process_state().get("live_view")
+
+    if view is not None and now - view[0] <= 2 * interval:
+        merged_at, rows = view
+        scope = "cluster"
+    else:
+        # no recent merge (Mongo down, or first seconds of a worker)
+        merged_at = now
+        rows = [(key, count) for key, count, _err in sketch().snapshot(now)]
+        scope = "worker"
+
+    limit = min(request.args.get("limit", 10, type=int) or 10, 50)
 
     return jsonify({
-        "redirect": url_for("today", city=city)
+        "scope": scope,
+        "age_s": round(now - merged_at, 1),
+        "cities": [
+            {"city": key, "score": round(count, 2)}
+            for key, count in rows[:limit]
+            if count >= 0.01
+        ]
     })
 
-# ================= TODAY =================
-@app.route("/weather/<city>/today")
-def today(city):
+# ================= CACHE SYNC =================
+# Each worker keeps its own caches, so a write in one is invisible to
+# the others until TTL expiry. With a replica set, one change stream
+# per worker clears the affected caches as soon as Mongo reports the
+# write. Without one (standalone server, or CACHE_SYNC=poll) writers
+# bump a counter in cache_versions and workers poll it instead.
 
-    r = requests.get(
-        "https://api.openweathermap.org/data/2.5/weather",
-        params={
-            "q": city,
-            "appid": API_KEY,
-            "units": "metric"
-        },
-        timeout=8
-    )
+CACHE_POLL_INTERVAL_S = 1.0
 
-    r.raise_for_status()
-    js = r.json()
+# "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = 286
 
-    sunrise = js["sys"]["sunrise"]
-    sunset = js["sys"]["sunset"]
 
-    data = {
-        "city": city,
-        "temp": round(js["main"]["temp"]),
-        "today_high": round(js["main"]["temp_max"]),
-        "today_low": round(js["main"]["temp_min"]),
-        "main": js["weather"][0]["main"],     
-        "desc": js["weather"][0]["description"],
-        "icon": weather_icon(
-            js["weather"][0]["main"],
-            js["weather"][0]["description"]
-        ),
-        "dt": datetime.now().strftime("%d %b %Y, %I:%M %p")
+def invalidated_by():
+    return {
+        "weather": [history_cache],
+        "trending_cities": [trending_cache]
     }
 
-    return render_template(
-        "today.html",
-        data=data,
-        sunrise=sunrise,
-        sunset=sunset
-    )
 
-# ================= WEATHER CITY =================
-@app.route("/weather/<city>")
-def weather_city(city):
-    return redirect(url_for("today", city=city))
+def invalidate(coll):
+    for cache in invalidated_by().get(coll, ()):
+        cache.clear()
 
-# ================= HISTORY =================
-@app.route("/api/history")
-def api_history():
 
-    docs = list(
-        collection.find({}, {"_id": 0})
-        .sort("dt", -1)
-        .limit(6)
-    )
+def announce_write(coll):
+    if process_state().get("cache_sync") != "poll":
+        return
 
-    return jsonify([
-        {
-            "city": d["city"],
-            "temperature": d["temperature"],
-            "icon": weather_icon(d["main"], d["description"]),
-            "dt": d["dt"].strftime("%d-%b-%Y %I:%M %p")
-        }
-        for d in docs
-    ])
+    on_mongo(async_db().cache_versions.update_one(
+        {"_id": coll},
+        {"$inc": {"v": 1}},
+        upsert=True
+    )).add_done_callback(log_failure("cache version bump"))
 
-# ================= HOURLY =================
-@app.route("/weather/<city>/hourly")
-def hourly(city):
 
-    # current weather (for NOW)
-    current = requests.get(
-        "https://api.openweathermap.org/data/2.5/weather",
-        params={
-            "q": city,
-            "appid": API_KEY,
-            "units": "metric"
-        },
-        timeout=8
-    )
+def _watch_changes(db):
+    pipeline = [
+        {"$match": {"ns.coll": {"$in": list(invalidated_by())}}},
+        {"$project": {"ns": 1}}
+    ]
+    token = None
 
-    current.raise_for_status()
-    current_js = current.json()
+    while True:
+        try:
+            with db.watch(pipeline, resume_after=token) as stream:
+                process_state()["cache_sync"] = "changestream"
 
-    r = requests.get(
-        "https://api.openweathermap.org/data/2.5/forecast",
-        params={
-            "q": city,
-            "appid": API_KEY,
-            "units": "metric"
-        },
-        timeout=8
+                for change in stream:
+                    invalidate(change["ns"]["coll"])
+                    token = stream.resume_token
+
+        except OperationFailure as e:
+            # only a standalone server's refusal switches this worker to
+            # polling, which the others would not feed; anything else
+            # (auth, lost history, a stepdown) is resumed
+            if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                raise
+
+            current_app.logger.exception("change stream failed")
+
+            if e.code == CHANGE_STREAM_HISTORY_LOST:
+                # the oplog has moved past the token: start from now and
+                # drop whatever the gap may have changed
+                token = None
+
+                for coll in invalidated_by():
+                    invalidate(coll)
+
+            time.sleep(1)
+        except PyMongoError:
+            current_app.logger.exception("change stream dropped")
+            time.sleep(1)
+
+
+def _poll_versions(db):
+    process_state()["cache_sync"] = "poll"
+    seen = {}
+
+    while True:
+        try:
+            for doc in db.cache_versions.find():
+                if seen.get(doc["_id"], doc["v"]) != doc["v"]:
+                    invalidate(doc["_id"])
+
+                seen[doc["_id"]] = doc["v"]
+
+        except PyMongoError:
+            current_app.logger.exception("cache version poll failed")
+
+        time.sleep(CACHE_POLL_INTERVAL_S)
+
+
+@background("cache-sync")
+def cache_sync_loop():
+    mode = current_app.config["CACHE_SYNC"]
+    db = get_db()
+
+    if mode == "off":
+        return
+
+    if mode in ("auto", "changestream"):
+        try:
+            _watch_changes(db)
+        except OperationFailure:
+            if mode == "changestream":
+                raise
+
+            current_app.logger.warning(
+                "change streams unavailable, polling cache_versions"
+            )
+
+    _poll_versions(db)
+
+# ================= TILES =================
+# Map tiles go through /tiles/<z>/<x>/<y>.png instead of straight to
+# the tile server. They are cached by a TileCache (tiles.py) under
+# TILE_CACHE_DIR, capped at TILE_CACHE_BYTES across workers, and
+# refetched after TILE_MAX_AGE.
+
+TILE_MAX_ZOOM = 19
+
+
+def tile_cache():
+    cfg = current_app.config
+
+    return lazy("tile_cache", lambda: TileCache(
+        cfg["TILE_CACHE_DIR"], cfg["TILE_CACHE_BYTES"]
+    ))
+
+
+def load_tile(z, x, y):
+    cfg = current_app.config
+
+    r = http().get(
+        cfg["TILE_UPSTREAM"].format(z=z, x=x, y=y),
+        headers={"User-Agent": cfg["TILE_USER_AGENT"]},
+        timeout=10
     )
 
+    if r.status_code == 404:
+        return None
+
     r.raise_for_status()
-    js = r.json()
+    return r.content
 
-    tz_offset = js["city"]["timezone"]
 
-    hourly_data = []
+@bp.route("/tiles/<int:z>/<int:x>/<int:y>.png")
+def tile(z, x, y):
 
-    # add NOW manually
-    hourly_data.append({
-        "time": "NOW",
-        "temp": round(current_js["main"]["temp"]),
-        "humidity": current_js["main"]["humidity"],
-        "icon": weather_icon(
-            current_js["weather"][0]["main"],
-            current_js["weather"][0]["description"]
-        ),
-        "is_now": True
+    if z > TILE_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return jsonify({"error": "No such tile"}), 404
+
+    cache = tile_cache()
+    path = cache.path(z, x, y)
+    max_age = current_app.config["TILE_MAX_AGE"]
+
+    body, fresh = cache.lookup(path, max_age)
+
+    if not fresh:
+        try:
+            body = cache.fetch(path, lambda: load_tile(z, x, y))
+        except Exception as e:
+            # an expired tile beats no tile while upstream is down
+            if body is None:
+                logger.warning("tile %s/%s/%s failed: %s", z, x, y, e)
+                return jsonify({"error": "Tile server unavailable"}), 502
+        else:
+            if body is None:
+                return jsonify({"error": "No such tile"}), 404
+
+    resp = current_app.response_class(body, mimetype="image/png")
+    resp.set_etag(hashlib.sha1(body).hexdigest())
+    resp.cache_control.public = True
+    resp.cache_control.max_age = max_age
+    resp.cache_control.stale_while_revalidate = max_age
+
+    return resp.make_conditional(request)
+
+# ================= METRICS =================
+@bp.route("/api/metrics/mongo")
+def api_mongo_metrics():
+
+    stats = process_state().get("pool_stats")
+
+    return jsonify({
+        "pid": os.getpid(),
+        "max_pool_size": current_app.config["MONGO_MAX_POOL_SIZE"],
+        "async_pool_size": current_app.config["MONGO_ASYNC_POOL_SIZE"],
+        "pool": stats.snapshot() if stats else None
     })
 
-    # forecast hours
-    for it in js["list"][:11]:
 
-        local_time = (
-            _dt.utcfromtimestamp(it["dt"]) +
-            timedelta(seconds=tz_offset)
+@bp.route("/api/metrics/compression")
+def api_compression_metrics():
+    return jsonify({"pid": os.getpid(), **compression_stats.snapshot()})
+
+
+@bp.route("/api/metrics/render", methods=["GET", "POST"])
+def api_render_metrics():
+
+    if request.method == "GET":
+        return jsonify({"pid": os.getpid(), **render_timings.snapshot()})
+
+    # navigation timing beacon from timing.js
+    try:
+        beacon = json.loads(request.get_data(as_text=True) or "{}")
+    except ValueError:
+        return jsonify({"error": "Bad beacon"}), 400
+
+    page_name = beacon.get("page")
+    mode = "stream" if beacon.get("streamed") else "buffered"
+
+    if page_name not in ("today", "hourly", "daily"):
+        return jsonify({"error": "Bad beacon"}), 400
+
+    for metric in ("first_byte", "first_paint", "total"):
+        ms = beacon.get(metric)
+
+        if isinstance(ms, (int, float)) and 0 <= ms < 120000:
+            render_timings.record(page_name, mode, metric, float(ms))
+
+    return "", 204
+
+
+@bp.route("/api/metrics/tiles")
+def api_tile_metrics():
+    return jsonify({"pid": os.getpid(), **tile_cache().snapshot()})
+
+# ================= FORECAST ACCURACY =================
+# Serves the summary `flask score-forecasts` (forecast_accuracy.py)
+# writes to forecast_accuracy.
+
+accuracy_cache = TTLCache(maxsize=256, ttl=600)
+
+
+@bp.route("/api/forecast-accuracy")
+def api_forecast_accuracy():
+
+    city = request.args.get("city", "").strip()
+    query = {}
+
+    if city:
+        city_id = resolve_city_id(city)
+
+        if city_id is None:
+            return jsonify({"error": "No observations for city"}), 404
+
+        query["city_id"] = city_id
+
+    key = query.get("city_id", "all")
+    hit = accuracy_cache.get(key)
+
+    if hit is None:
+        rows = list(
+            get_db().forecast_accuracy
+            .find(query, {"_id": 0})
+            .sort([("city_id", 1), ("lead_h", 1)])
         )
 
-        hourly_data.append({
-            "time": local_time.strftime("%I:%M %p").lstrip("0"),
-            "temp": round(it["main"]["temp"]),
-            "humidity": it["main"]["humidity"],
-            "icon": weather_icon(
-                it["weather"][0]["main"],
-                it["weather"][0]["description"]
-            ),
-            "is_now": False
-        })
+        for row in rows:
+            row["scored"] = row["scored"].strftime("%Y-%m-%dT%H:%M:%SZ")
 
-    current_weather = current_js["weather"][0]["main"]
+        body = json.dumps(rows)
+        hit = (body, hashlib.sha1(body.encode()).hexdigest())
+        accuracy_cache.set(key, hit)
 
-    return render_template(
-        "hourly.html",
-        city=city,
-        hourly=hourly_data,
-        weather_main=current_weather
-    )
+    body, etag = hit
+    return cached_json(body, etag, accuracy_cache.ttl)
 
-# ================= DAILY =================
-@app.route("/weather/<city>/daily")
-def daily(city):
+# ================= APP =================
+def create_app(config=None):
+    load_dotenv()
 
-    r = requests.get(
-        "https://api.openweathermap.org/data/2.5/forecast",
-        params={
-            "q": city,
-            "appid": API_KEY,
-            "units": "metric"
-        },
-        timeout=8
+    app = Flask(__name__)
+
+    app.config.update(
+        OWM_API_KEY=os.getenv("OWM_API_KEY"),
+        MONGO_URI=os.getenv("MONGO_URI"),
+        MONGO_DB=os.getenv("MONGO_DB", "weather_db"),
+        SECRET_KEY=os.getenv("SECRET_KEY"),
+        TEMPLATES_AUTO_RELOAD=True,
+        # one pooled connection per request thread plus headroom for
+        # background tasks, per worker and across both clients: the
+        # async (Mongo loop) client takes MONGO_ASYNC_POOL_SIZE of it,
+        # half by default, and the sync client the rest. A Mongo outage
+        # fails fast instead of hanging each request for pymongo's 30 s
+        # default
+        MONGO_MAX_POOL_SIZE=int(os.getenv(
+            "MONGO_MAX_POOL_SIZE",
+            int(os.getenv("GUNICORN_THREADS", "8")) + 4
+        )),
+        MONGO_ASYNC_POOL_SIZE=int(os.getenv("MONGO_ASYNC_POOL_SIZE", "0")),
+        MONGO_MIN_POOL_SIZE=int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        MONGO_SERVER_SELECTION_TIMEOUT_MS=int(
+            os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000")
+        ),
+        MONGO_SOCKET_TIMEOUT_MS=int(
+            os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000")
+        ),
+        MONGO_HISTORY_W=os.getenv("MONGO_HISTORY_W", "1"),
+        CACHE_SYNC=os.getenv("CACHE_SYNC", "auto"),
+        COMPRESS_MIN_BYTES=int(os.getenv("COMPRESS_MIN_BYTES", "1024")),
+        RENDER_CACHE_BYTES=int(
+            os.getenv("RENDER_CACHE_BYTES", str(16 * 1024 * 1024))
+        ),
+        LIVE_TOP_K=int(os.getenv("LIVE_TOP_K", "64")),
+        LIVE_WINDOW_S=int(os.getenv("LIVE_WINDOW_S", "300")),
+        LIVE_MERGE_INTERVAL_S=int(os.getenv("LIVE_MERGE_INTERVAL_S", "10")),
+        TRENDING_INTERVAL_S=int(os.getenv("TRENDING_INTERVAL_S", "300")),
+        TRENDING_WINDOW_HOURS=int(os.getenv("TRENDING_WINDOW_HOURS", "24")),
+        TRENDING_HALF_LIFE_HOURS=float(
+            os.getenv("TRENDING_HALF_LIFE_HOURS", "6")
+        ),
+        MONGO_HISTORY_READ_PREFERENCE=os.getenv(
+            "MONGO_HISTORY_READ_PREFERENCE", "primaryPreferred"
+        ),
+        TILE_UPSTREAM=os.getenv(
+            "TILE_UPSTREAM", "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+        ),
+        TILE_USER_AGENT=os.getenv(
+            "TILE_USER_AGENT", "SkyCast tile proxy (weather_search_website)"
+        ),
+        TILE_CACHE_DIR=os.getenv("TILE_CACHE_DIR"),
+        TILE_CACHE_BYTES=int(
+            os.getenv("TILE_CACHE_BYTES", str(512 * 1024 * 1024))
+        ),
+        # OSM asks proxies to keep tiles at least 7 days
+        TILE_MAX_AGE=int(os.getenv("TILE_MAX_AGE", str(7 * 24 * 3600))),
+        STREAM_PAGES=os.getenv("STREAM_PAGES", "1") == "1"
     )
 
-    r.raise_for_status()
-    js = r.json()
+    if config:
+        app.config.update(config)
 
-    grouped = defaultdict(list)
+    if not app.config["OWM_API_KEY"]:
+        raise RuntimeError("Set OWM_API_KEY")
+    if not app.config["MONGO_URI"]:
+        raise RuntimeError("Set MONGO_URI")
 
-    for it in js["list"]:
-        grouped[it["dt_txt"].split()[0]].append(it)
+    pools = app.config["MONGO_MAX_POOL_SIZE"]
 
-    days = []
+    if not app.config["MONGO_ASYNC_POOL_SIZE"]:
+        app.config["MONGO_ASYNC_POOL_SIZE"] = pools // 2
+    if not 0 < app.config["MONGO_ASYNC_POOL_SIZE"] < pools:
+        raise RuntimeError("MONGO_ASYNC_POOL_SIZE must leave both clients a pool")
+    if app.config["MONGO_HISTORY_READ_PREFERENCE"] not in READ_PREFERENCES:
+        raise RuntimeError("Bad MONGO_HISTORY_READ_PREFERENCE")
+    if app.config["CACHE_SYNC"] not in ("auto", "changestream", "poll", "off"):
+        raise RuntimeError("CACHE_SYNC must be auto, changestream, poll or off")
 
-    for d in sorted(grouped)[:5]:
+    if not app.config["TILE_CACHE_DIR"]:
+        app.config["TILE_CACHE_DIR"] = os.path.join(app.instance_path, "tiles")
 
-        items = grouped[d]
+    app.register_blueprint(bp)
 
-        temps = [x["main"]["temp"] for x in items]
+    app.view_functions["static"] = serve_static
+    app.wsgi_app = Compress(app.wsgi_app, app.config["COMPRESS_MIN_BYTES"])
+    app.cli.add_command(compress_static)
 
-        main = Counter(
-            [x["weather"][0]["main"] for x in items]
-        ).most_common(1)[0][0]
+    app.url_defaults(fingerprint_static)
+    app.cli.add_command(assets_cli)
 
-        desc = Counter(
-            [x["weather"][0]["description"] for x in items]
-        ).most_common(1)[0][0]
+    app.add_template_global(background_for)
+    assets_cli.add_command(assets_backgrounds)
 
-        days.append({
-            "label": _dt.strptime(d, "%Y-%m-%d").strftime("%a").upper(),
-            "date": _dt.strptime(d, "%Y-%m-%d").strftime("%m/%d"),
-            "icon": weather_icon(main, desc),
-            "hi": round(max(temps)),
-            "lo": round(min(temps)),
-            "desc": desc.capitalize()
-        })
+    app.cli.add_command(export_observations)
+    app.cli.add_command(score_forecasts_command)
 
-    # ⭐ get current weather for background
-    current_weather = js["list"][0]["weather"][0]["main"]
+    app.config.setdefault("TEMPLATE_VERSION", template_version(app))
 
-    return render_template(
-        "daily.html",
-        city=city,
-        days=days,
-        weather_main=current_weather
-    )
+    # workers that were not started through a post-fork hook (flask run,
+    # plain gunicorn) bring their background threads up on first request
+    app.before_request(lambda: start_background(app))
+
+    return app
 
 # ================= RUN =================
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5001)
\ No newline at end of file
+    create_app().run(debug=True, host="0.0.0.0", port=5001)
@@ -0,0 +1,204 @@
+from flask.cli import with_appcontext
+from resources import get_db
+from datetime import datetime, timedelta
+import os
+import json
+import time
+import click
+
+# ================= PARQUET EXPORT =================
+# `flask export-observations` streams the stored data out of Mongo into
+# one Parquet file per dataset and UTC day:
+#
+#   <out>/<dataset>/date=YYYY-MM-DD/part-0.parquet
+#
+# Rows are written as record batches, so memory is bounded by --batch
+# rows whatever the range. Finished days are recorded in
+# <out>/_checkpoint.json and skipped when the command is rerun.
+
+def _seen(doc, key, field):
+    if key in doc:
+        return doc[key]
+
+    return (doc.get("seen") or {}).get(field)
+
+
+def _coord(doc, i):
+    coords = (doc.get("location") or {}).get("coordinates")
+
+    if coords:
+        return coords[i]
+
+    coord = doc.get("coord") or {}
+    return coord.get("lon" if i == 0 else "lat")
+
+
+EXPORT_DATASETS = {
+    "observations": ("observations", "ts", [
+        ("ts", "ts"), ("city_id", "int"), ("city", "str"),
+        ("lat", "float", lambda d: _coord(d, 1)),
+        ("lon", "float", lambda d: _coord(d, 0)),
+        ("temp", "float"), ("temp_min", "float"), ("temp_max", "float"),
+        ("humidity", "float"), ("pressure", "float"),
+        ("wind_speed", "float"), ("weather_id", "int"),
+        ("main", "str"), ("description", "str"), ("fetched", "ts")
+    ]),
+    "forecasts": ("forecasts", "ts", [
+        ("ts", "ts"), ("city_id", "int"), ("city", "str"),
+        ("run", "ts"), ("fetched", "ts"),
+        ("temp", "float"), ("humidity", "float"), ("weather_id", "int"),
+        ("main", "str"), ("description", "str")
+    ]),
+    "searches": ("weather", "dt", [
+        ("dt", "ts"), ("city", "str"), ("city_id", "int"),
+        ("obs_dt", "ts"),
+        ("lat", "float", lambda d: _coord(d, 1)),
+        ("lon", "float", lambda d: _coord(d, 0)),
+        # set on records written before the event/observation split;
+        # newer ones carry them under "seen" if their observation was lost
+        ("temperature", "float", lambda d: _seen(d, "temperature", "temp")),
+        ("main", "str", lambda d: _seen(d, "main", "main")),
+        ("description", "str",
+         lambda d: _seen(d, "description", "description"))
+    ])
+}
+
+
+def _arrow_schema(pa, fields):
+    types = {
+        "ts": pa.timestamp("ms"),
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "str": pa.string()
+    }
+
+    return pa.schema([(f[0], types[f[1]]) for f in fields])
+
+
+def _columns(fields, docs):
+    return {
+        f[0]: [f[2](d) if len(f) > 2 else d.get(f[0]) for d in docs]
+        for f in fields
+    }
+
+
+def _load_checkpoint(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_checkpoint(path, state):
+    tmp = path + ".tmp"
+
+    with open(tmp, "w") as fh:
+        json.dump(state, fh, indent=1, sort_keys=True)
+
+    os.replace(tmp, path)
+
+
+def export_dataset(pa, pq, name, out, since, until, batch, checkpoint):
+    coll, time_field, fields = EXPORT_DATASETS[name]
+    schema = _arrow_schema(pa, fields)
+
+    state = _load_checkpoint(checkpoint)
+    done = state.get(name)
+
+    if done:
+        since = max(since, datetime.strptime(done, "%Y-%m-%d") + timedelta(days=1))
+
+    if since >= until:
+        return 0
+
+    cursor = (
+        get_db()[coll]
+        .find({time_field: {"$gte": since, "$lt": until}}, {"_id": 0})
+        .sort(time_field, 1)
+        .batch_size(batch)
+    )
+
+    rows = 0
+    day = writer = None
+    pending = []
+
+    def flush():
+        if pending:
+            writer.write_batch(pa.RecordBatch.from_pydict(
+                _columns(fields, pending), schema=schema
+            ))
+            pending.clear()
+
+    def close_day():
+        flush()
+        writer.close()
+        state[name] = day
+        _save_checkpoint(checkpoint, state)
+
+    for doc in cursor:
+        doc_day = doc[time_field].strftime("%Y-%m-%d")
+
+        if doc_day != day:
+            if writer is not None:
+                close_day()
+
+            day = doc_day
+            part = os.path.join(out, name, f"date={day}")
+            os.makedirs(part, exist_ok=True)
+
+            # a rerun after a crash rewrites the unfinished day whole
+            writer = pq.ParquetWriter(
+                os.path.join(part, "part-0.parquet"),
+                schema,
+                compression="zstd"
+            )
+
+        pending.append(doc)
+        rows += 1
+
+        if len(pending) >= batch:
+            flush()
+
+    if writer is not None:
+        close_day()
+
+    return rows
+
+
+@click.command("export-observations")
+@click.option("--out", default="exports", show_default=True,
+              type=click.Path(file_okay=False))
+@click.option("--dataset", "datasets", multiple=True,
+              type=click.Choice(list(EXPORT_DATASETS)),
+              help="Repeatable; defaults to all datasets.")
+@click.option("--since", type=click.DateTime(["%Y-%m-%d"]),
+              help="First UTC day to export.")
+@click.option("--until", type=click.DateTime(["%Y-%m-%d"]),
+              help="Export days before this one (default: today, UTC).")
+@click.option("--batch", default=10000, show_default=True,
+              help="Rows per record batch.")
+@with_appcontext
+def export_observations(out, datasets, since, until, batch):
+    """Export stored observations and searches to day-partitioned Parquet."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise click.ClickException("export-observations needs pyarrow")
+
+    since = since or datetime(1970, 1, 1)
+    until = until or datetime.utcnow().replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+
+    os.makedirs(out, exist_ok=True)
+    checkpoint = os.path.join(out, "_checkpoint.json")
+
+    for name in datasets or EXPORT_DATASETS:
+        started = time.perf_counter()
+        rows = export_dataset(pa, pq, name, out, since, until, batch, checkpoint)
+
+        click.echo(
+            f"{name}: {rows} rows in {time.perf_counter() - started:.1f}s"
+        )
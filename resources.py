@@ -0,0 +1,254 @@
+from flask import current_app
+from pymongo import AsyncMongoClient, MongoClient, monitoring
+import requests
+import asyncio
+import os
+import threading
+
+# ================= PROCESS RESOURCES =================
+# Nothing that opens a socket or a thread is created at import time.
+# Each process builds its own Mongo client, HTTP session and background
+# threads on first use, so a parent that imports the code before
+# forking (gunicorn --preload) never hands shared connections to its
+# workers.
+
+_proc = {"pid": None}
+_proc_lock = threading.Lock()
+
+BACKGROUND = {}
+
+
+def process_state():
+    pid = os.getpid()
+
+    if _proc["pid"] != pid:
+        with _proc_lock:
+            if _proc["pid"] != pid:
+                _proc.clear()
+                _proc["pid"] = pid
+
+    return _proc
+
+
+def lazy(name, factory):
+    state = process_state()
+    value = state.get(name)
+
+    if value is None:
+        with _proc_lock:
+            value = state.get(name)
+
+            if value is None:
+                value = state[name] = factory()
+
+    return value
+
+
+def mongo_options(cfg, pool_size):
+    # the sync and async clients each get their own share of
+    # MONGO_MAX_POOL_SIZE; see create_app()
+    return {
+        "maxPoolSize": pool_size,
+        "minPoolSize": min(cfg["MONGO_MIN_POOL_SIZE"], pool_size),
+        "serverSelectionTimeoutMS": cfg["MONGO_SERVER_SELECTION_TIMEOUT_MS"],
+        "socketTimeoutMS": cfg["MONGO_SOCKET_TIMEOUT_MS"],
+        "event_listeners": [lazy("pool_stats", PoolStats)]
+    }
+
+
+def mongo_client():
+    cfg = current_app.config
+    options = mongo_options(
+        cfg, cfg["MONGO_MAX_POOL_SIZE"] - cfg["MONGO_ASYNC_POOL_SIZE"]
+    )
+    return lazy("mongo", lambda: MongoClient(cfg["MONGO_URI"], **options))
+
+
+def get_db():
+    return mongo_client()[current_app.config["MONGO_DB"]]
+
+# ================= ASYNC MONGO =================
+# An AsyncMongoClient is bound to the loop it first ran on, so each
+# process keeps one long-lived loop thread that owns the async client.
+# Views stay synchronous: writes are handed to the loop and not waited
+# for, reads block the request thread on the result (an async Flask
+# view would hold that thread just the same, plus a loop per request).
+
+
+def mongo_loop():
+    return lazy("mongo_loop", _start_mongo_loop)
+
+
+def _start_mongo_loop():
+    loop = asyncio.new_event_loop()
+
+    threading.Thread(
+        target=loop.run_forever,
+        name="mongo-loop",
+        daemon=True
+    ).start()
+
+    return loop
+
+
+def async_db():
+    cfg = current_app.config
+    options = mongo_options(cfg, cfg["MONGO_ASYNC_POOL_SIZE"])
+
+    client = lazy(
+        "async_mongo",
+        lambda: AsyncMongoClient(cfg["MONGO_URI"], **options)
+    )
+
+    return client[cfg["MONGO_DB"]]
+
+
+def on_mongo(coro):
+    return asyncio.run_coroutine_threadsafe(coro, mongo_loop())
+
+
+def run_mongo(coro):
+    # the request thread waits; the client's timeouts bound the wait
+    return on_mongo(coro).result()
+
+
+async def aggregate_list(col, pipeline, then=None):
+    cursor = await col.aggregate(pipeline)
+    docs = await cursor.to_list()
+    return await then(docs) if then else docs
+
+
+# ================= POOL METRICS =================
+# Checkout wait is the time a request thread spends waiting for a free
+# pooled connection. If it climbs under load, maxPoolSize is too small
+# for the worker's thread count.
+
+POOL_WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.failures = 0
+        self.in_use = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.buckets = [0] * (len(POOL_WAIT_BUCKETS_MS) + 1)
+
+    def _waited(self, event):
+        ms = (event.duration or 0) * 1000
+
+        with self._lock:
+            self.wait_total_ms += ms
+            self.wait_max_ms = max(self.wait_max_ms, ms)
+
+            for i, edge in enumerate(POOL_WAIT_BUCKETS_MS):
+                if ms <= edge:
+                    self.buckets[i] += 1
+                    break
+            else:
+                self.buckets[-1] += 1
+
+    def connection_checked_out(self, event):
+        self._waited(event)
+
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+
+    def connection_check_out_failed(self, event):
+        self._waited(event)
+
+        with self._lock:
+            self.failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self):
+        with self._lock:
+            waits = self.checkouts + self.failures
+
+            return {
+                "checkouts": self.checkouts,
+                "failures": self.failures,
+                "in_use": self.in_use,
+                "wait_avg_ms": round(self.wait_total_ms / waits, 3) if waits else 0,
+                "wait_max_ms": round(self.wait_max_ms, 3),
+                "wait_buckets_ms": dict(zip(
+                    [f"le_{edge}" for edge in POOL_WAIT_BUCKETS_MS] + ["inf"],
+                    self.buckets
+                ))
+            }
+
+    # the remaining pool events are not needed for the wait metrics
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+def http():
+    return lazy("http", requests.Session)
+
+
+def background(name):
+
+    def register(fn):
+        BACKGROUND[name] = fn
+        return fn
+
+    return register
+
+
+def start_background(app):
+    state = process_state()
+
+    if state.get("threads") is not None:
+        return
+
+    with _proc_lock:
+        if state.get("threads") is not None:
+            return
+
+        state["threads"] = {}
+
+        for name, fn in BACKGROUND.items():
+            t = threading.Thread(
+                target=_run_background,
+                args=(app, name, fn),
+                name=name,
+                daemon=True
+            )
+            state["threads"][name] = t
+            t.start()
+
+
+def _run_background(app, name, fn):
+    with app.app_context():
+        try:
+            fn()
+        except Exception:
+            current_app.logger.exception("background task %s crashed", name)
@@ -1,27 +1,5 @@
-const weather = (document.body.dataset.weather || "").toLowerCase()
-
-const backgrounds = {
-
-clear: "https://images.pexels.com/photos/912110/pexels-photo-912110.jpeg",
-
-clouds: "https://images.pexels.com/photos/531767/pexels-photo-531767.jpeg",
-
-rain: "https://images.pexels.com/photos/110874/pexels-photo-110874.jpeg",
-
-snow: "https://images.pexels.com/photos/688660/pexels-photo-688660.jpeg",
-
-mist: "https://images.pexels.com/photos/167699/pexels-photo-167699.jpeg"
+/* ---------------- OFFLINE ---------------- */
 
+if("serviceWorker" in navigator){
+navigator.serviceWorker.register("/sw.js").catch(() => {})
 }
-
-let bg = backgrounds.clouds
-
-if(weather.includes("clear")) bg = backgrounds.clear
-else if(weather.includes("cloud")) bg = backgrounds.clouds
-else if(weather.includes("rain")) bg = backgrounds.rain
-else if(weather.includes("snow")) bg = backgrounds.snow
-else if(weather.includes("mist") || weather.includes("fog") || weather.includes("haze")) bg = backgrounds.mist
-
-document.body.style.backgroundImage = `url(${bg})`
-document.body.style.backgroundSize = "cover"
-document.body.style.backgroundPosition = "center"
\ No newline at end of file
@@ -1,13 +1,72 @@
 /* ---------------- MAP ---------------- */
 
-const map = L.map('owmMap', { preferCanvas: true }).setView([20, 0], 3);
+/* Leaflet and the map code load only when the map comes into view */
 
-let markersGroup = L.layerGroup().addTo(map);
+const mapEl = document.getElementById("owmMap");
 
-L.tileLayer(
-'https://tile.openstreetmap.org/{z}/{x}/{y}.png',
-{ maxZoom: 19 }
-).addTo(map);
+let mapReady = null;
+
+function loadAsset(tag, attrs){
+
+return new Promise((resolve, reject) => {
+
+const el = document.createElement(tag);
+
+Object.assign(el, attrs);
+
+el.onload = resolve;
+el.onerror = reject;
+
+document.head.appendChild(el);
+
+});
+
+}
+
+function ensureMap(){
+
+if(!mapReady){
+
+mapReady = Promise.all([
+loadAsset("link", { rel: "stylesheet", href: mapEl.dataset.leafletCss }),
+loadAsset("script", { src: mapEl.dataset.leafletJs })
+])
+.then(() => loadAsset("script", { src: mapEl.dataset.mapJs }))
+.then(() => window.initWeatherMap(mapEl));
+
+mapReady.catch(e => {
+console.error("Map load failed", e);
+mapReady = null;
+});
+
+}
+
+return mapReady;
+
+}
+
+if(mapEl){
+
+if("IntersectionObserver" in window){
+
+const mapObserver = new IntersectionObserver((entries) => {
+
+if(entries.some(e => e.isIntersecting)){
+mapObserver.disconnect();
+ensureMap();
+}
+
+}, { rootMargin: "200px" });
+
+mapObserver.observe(mapEl);
+
+}else{
+
+ensureMap();
+
+}
+
+}
 
 
 /* ---------------- SEARCH ---------------- */
@@ -97,11 +156,11 @@ return;
 
 document.getElementById("historyList").innerHTML =
 arr.map(item => `
-<div class="card recent-card" data-city="${item.city}">
-<div class="city">${item.city}</div>
+<div class="card recent-card" data-city="${esc(item.city)}">
+<div class="city">${esc(item.city)}</div>
 
 <div class="mid-row">
-<div class="weather-icon">${item.icon || "☀️"}</div>
+<div class="weather-icon">${esc(item.icon || "☀️")}</div>
 <div class="temp">${Math.round(item.temperature)}°C</div>
 </div>
 
@@ -122,6 +181,83 @@ document.getElementById("historyList").innerHTML =
 loadHistory();
 
 
+/* ---------------- TRENDING ---------------- */
+
+async function loadTrending(){
+
+const box = document.getElementById("trendingList");
+
+if(!box) return;
+
+try{
+
+const r = await fetch("/api/trending");
+const data = await r.json();
+
+if(!data.cities || !data.cities.length){
+box.innerHTML = "Nothing trending yet";
+return;
+}
+
+box.innerHTML =
+data.cities.map(item => `
+<div class="card recent-card" data-city="${esc(item.city)}">
+<div class="city">${esc(item.city)}</div>
+<div class="mid-row">${esc(item.searches)} searches</div>
+</div>
+`).join("");
+
+}catch(e){
+
+console.error("Trending load failed", e);
+
+box.innerHTML = "";
+
+}
+
+}
+
+loadTrending();
+
+
+/* ---------------- LIVE POPULARITY ---------------- */
+
+async function loadLive(){
+
+const box = document.getElementById("liveList");
+
+if(!box) return;
+
+try{
+
+const r = await fetch("/api/trending/live?limit=6");
+const data = await r.json();
+
+if(!data.cities || !data.cities.length){
+box.innerHTML = "Quiet right now";
+return;
+}
+
+box.innerHTML =
+data.cities.map(item => `
+<div class="card recent-card" data-city="${esc(item.city)}">
+<div class="city">${esc(item.city)}</div>
+</div>
+`).join("");
+
+}catch(e){
+
+console.error("Live popularity load failed", e);
+
+}
+
+}
+
+loadLive();
+
+setInterval(loadLive, 30000);
+
+
 /* Click history */
 
 document.addEventListener("click",(e)=>{
@@ -206,6 +342,8 @@ return;
 const lat = data[0].lat;
 const lon = data[0].lon;
 
+const { map, markersGroup } = await ensureMap();
+
 map.setView([lat,lon],10);
 
 markersGroup.clearLayers();
@@ -243,11 +381,13 @@ alert("Geolocation not supported");
 return;
 }
 
-navigator.geolocation.getCurrentPosition((pos)=>{
+navigator.geolocation.getCurrentPosition(async (pos)=>{
 
 const lat = pos.coords.latitude;
 const lon = pos.coords.longitude;
 
+const { map, markersGroup } = await ensureMap();
+
 map.setView([lat,lon],10);
 
 markersGroup.clearLayers();
@@ -358,4 +498,11 @@ else{
 
 clouds.style.opacity = ".5"
 
-}
\ No newline at end of file
+}
+
+
+/* ---------------- OFFLINE ---------------- */
+
+if("serviceWorker" in navigator){
+navigator.serviceWorker.register("/sw.js").catch(() => {})
+}
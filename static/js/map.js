@@ -0,0 +1,80 @@
+/* ---------------- MAP ---------------- */
+
+/* loaded by main.js once #owmMap scrolls into view, after Leaflet */
+
+window.initWeatherMap = function(el){
+
+const map = L.map(el, { preferCanvas: true }).setView([20, 0], 3);
+
+let markersGroup = L.layerGroup().addTo(map);
+
+L.tileLayer(
+'/tiles/{z}/{x}/{y}.png',
+{
+maxZoom: 19,
+attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
+}
+).addTo(map);
+
+
+/* ---------------- NEARBY SEARCHES ---------------- */
+
+let nearbyGroup = L.layerGroup().addTo(map);
+
+let nearbyTimer = null;
+
+async function loadNearby(){
+
+if(map.getZoom() < 6){
+nearbyGroup.clearLayers();
+return;
+}
+
+const c = map.getCenter();
+
+const b = map.getBounds();
+
+const km = Math.min(
+2000,
+Math.ceil(c.distanceTo(b.getNorthEast()) / 1000)
+);
+
+try{
+
+const r = await fetch(
+`/api/history/near?lat=${c.lat.toFixed(4)}&lon=${c.lng.toFixed(4)}&km=${km}`
+);
+
+if(!r.ok) return;
+
+const arr = await r.json();
+
+nearbyGroup.clearLayers();
+
+arr.forEach(item => {
+
+L.marker([item.lat, item.lon])
+.addTo(nearbyGroup)
+.bindPopup(`<b>${esc(item.city)}</b><br>${esc(item.icon)} ${Math.round(item.temperature)}°C`)
+.on("dblclick", () => refreshAndOpen(item.city,""));
+
+});
+
+}catch(e){
+console.error("Nearby load failed", e);
+}
+
+}
+
+map.on("moveend", () => {
+
+clearTimeout(nearbyTimer);
+
+nearbyTimer = setTimeout(loadNearby, 300);
+
+});
+
+
+return { map, markersGroup };
+
+}
@@ -0,0 +1,213 @@
+/* ---------------- TABS ---------------- */
+
+/* today / hourly / daily switch client-side from one bundle request;
+   the links stay real links, so a failed bundle just navigates */
+
+const tabs = document.getElementById("tabs");
+
+/* same as Jinja's |capitalize */
+const capitalize = (s) => {
+s = String(s ?? "");
+return s.charAt(0).toUpperCase() + s.slice(1).toLowerCase();
+};
+
+
+/* ---------------- VIEWS ---------------- */
+
+/* mirror templates/today.html, hourly.html and daily.html */
+
+const views = {
+
+today: {
+
+title: v => `Today — ${v.data.city}`,
+
+html: v => `
+<div class="weather-page">
+<div class="weather-info">
+<div class="city">${esc(capitalize(v.data.city))}</div>
+<div class="temp">${esc(v.data.temp)}°C</div>
+<div class="desc">
+${esc(capitalize(v.data.desc))}
+<span class="weather-icon">${esc(v.data.icon || "")}</span>
+</div>
+<a href="/" class="back-btn">← Back</a>
+</div>
+</div>
+`
+
+},
+
+hourly: {
+
+title: v => `Hourly — ${v.city}`,
+
+html: v => `
+<div class="header">${esc(v.city)}</div>
+<div class="container">
+${v.hourly.map(h => `
+<div class="hour-box ${h.is_now ? "now" : ""}">
+<div class="time">${esc(h.time)}</div>
+<div class="icon">${esc(h.icon)}</div>
+<div class="temp">${esc(h.temp)}°C</div>
+</div>
+`).join("")}
+</div>
+<a href="/" class="back">← Back</a>
+`
+
+},
+
+daily: {
+
+title: v => `Daily — ${v.city}`,
+
+html: v => `
+<div class="header">
+<div class="title">5-DAY WEATHER FORECAST</div>
+<div class="city">${esc(capitalize(v.city))}</div>
+</div>
+<div class="slider" id="slider">
+${v.days.map(d => `
+<div class="slide">
+<div class="day">${esc(d.label)}</div>
+<div class="date">${esc(d.date)}</div>
+<div class="icon">${esc(d.icon)}</div>
+<div class="temp">${esc(d.hi)}°C</div>
+<div class="low">↓ ${esc(d.lo)}°C</div>
+<div class="desc">${esc(d.desc)}</div>
+</div>
+`).join("")}
+</div>
+<a href="/" id="backBtn" class="back">← Back</a>
+`
+
+}
+
+};
+
+
+/* ---------------- BUNDLE ---------------- */
+
+let bundle = null;
+
+function loadBundle(){
+
+if(!bundle){
+
+bundle = fetch(tabs.dataset.bundle)
+.then(r => {
+if(!r.ok) throw new Error(`bundle ${r.status}`);
+return r.json();
+});
+
+bundle.catch(() => { bundle = null; });
+
+}
+
+return bundle;
+
+}
+
+
+/* ---------------- SWITCH ---------------- */
+
+function swapStyle(href){
+
+return new Promise(resolve => {
+
+const old = document.querySelector("link[data-view-css]");
+
+if(old && old.getAttribute("href") === href){
+resolve();
+return;
+}
+
+const link = document.createElement("link");
+
+link.rel = "stylesheet";
+link.href = href;
+link.dataset.viewCss = "";
+
+link.onload = link.onerror = () => {
+if(old) old.remove();
+resolve();
+};
+
+/* same place in <head>, ahead of the background <style> in <body> */
+if(old) old.before(link);
+else document.head.prepend(link);
+
+});
+
+}
+
+async function show(view, push){
+
+const data = (await loadBundle())[view];
+const name = view.charAt(0).toUpperCase() + view.slice(1);
+
+await swapStyle(tabs.dataset["css" + name]);
+
+/* the background <style>/<link> and scripts stay */
+for(const node of [...document.body.childNodes]){
+if(node !== tabs && !["SCRIPT", "STYLE", "LINK"].includes(node.nodeName)) node.remove();
+}
+
+tabs.insertAdjacentHTML("beforebegin", views[view].html(data));
+
+document.title = views[view].title(data);
+document.body.dataset.page = view;
+
+for(const a of tabs.querySelectorAll("a[data-view]")){
+a.classList.toggle("active", a.dataset.view === view);
+}
+
+if(push){
+history.pushState(
+{ view }, "", tabs.querySelector(`a[data-view="${view}"]`).href
+);
+}
+
+window.scrollTo(0, 0);
+
+}
+
+
+if(tabs){
+
+history.replaceState({ view: tabs.dataset.view }, "");
+
+tabs.addEventListener("click", async (e) => {
+
+const a = e.target.closest("a[data-view]");
+
+if(!a || e.button || e.metaKey || e.ctrlKey || e.shiftKey || e.altKey) return;
+
+e.preventDefault();
+
+if(a.classList.contains("active")) return;
+
+try{
+await show(a.dataset.view, true);
+}catch(err){
+console.error("Tab switch failed", err);
+window.location.href = a.href;
+}
+
+});
+
+window.addEventListener("popstate", (e) => {
+
+const view = (e.state && e.state.view) || tabs.dataset.view;
+
+show(view, false).catch(() => window.location.reload());
+
+});
+
+/* fetch the other views' data once the page itself is done */
+(window.requestIdleCallback || setTimeout)(() => {
+loadBundle().catch(() => {});
+});
+
+}
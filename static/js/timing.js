@@ -0,0 +1,26 @@
+/* ---------------- PAGE TIMING ---------------- */
+
+/* first byte and first paint are reported apart from the full load, so
+   streamed pages can be compared with buffered ones */
+
+window.addEventListener("load", () => {
+
+/* loadEventEnd is only set once the load handlers have returned */
+setTimeout(() => {
+
+const nav = performance.getEntriesByType("navigation")[0];
+const paint = performance.getEntriesByName("first-contentful-paint")[0];
+
+if(!nav || !navigator.sendBeacon) return;
+
+navigator.sendBeacon("/api/metrics/render", JSON.stringify({
+page: document.body.dataset.page,
+streamed: "streamed" in document.body.dataset,
+first_byte: nav.responseStart,
+first_paint: paint ? paint.startTime : null,
+total: nav.loadEventEnd || nav.responseEnd
+}));
+
+}, 0);
+
+});
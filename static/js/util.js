@@ -0,0 +1,8 @@
+/* ---------------- UTIL ---------------- */
+
+/* shared by main.js, map.js and tabs.js; pages load it first */
+
+/* city names and the like come from other users' searches */
+const esc = (v) => String(v ?? "").replace(/[&<>"']/g, c => ({
+"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"
+}[c]));
@@ -0,0 +1,154 @@
+/* SkyCast service worker — served from /sw.js so it controls the whole site */
+
+const VERSION = {{ version|tojson }}
+
+const SHELL_CACHE = `skycast-shell-${VERSION}`
+const PAGE_CACHE = `skycast-pages-${VERSION}`
+
+const PRECACHE = {{ precache|tojson }}
+
+/* last-viewed weather pages and history kept for offline use */
+const PAGE_LIMIT = {{ page_limit }}
+
+/* how a streamed page (X-Streamed) ends when it rendered in full */
+const STREAM_DONE = {{ stream_done|tojson }}
+
+const PAGE_PATTERNS = [
+/^\/$/,
+/^\/weather\/[^/]+\/(today|hourly|daily)$/,
+/^\/api\/history$/,
+/^\/api\/city\/[^/]+\/bundle$/
+]
+
+
+/* ---------------- INSTALL ---------------- */
+
+self.addEventListener("install", (event) => {
+
+event.waitUntil(
+caches.open(SHELL_CACHE)
+.then(cache => cache.addAll(PRECACHE))
+.then(() => self.skipWaiting())
+)
+
+})
+
+
+/* ---------------- ACTIVATE ---------------- */
+
+self.addEventListener("activate", (event) => {
+
+event.waitUntil(
+caches.keys()
+.then(keys => Promise.all(
+keys
+.filter(k => k.startsWith("skycast-") && k !== SHELL_CACHE && k !== PAGE_CACHE)
+.map(k => caches.delete(k))
+))
+.then(() => self.clients.claim())
+)
+
+})
+
+
+/* ---------------- EVICTION ---------------- */
+
+async function trim(cacheName, limit){
+
+const cache = await caches.open(cacheName)
+const keys = await cache.keys()
+
+/* keys come back in insertion order; re-put entries move to the end */
+for(let i = 0; i < keys.length - limit; i++){
+await cache.delete(keys[i])
+}
+
+}
+
+
+/* ---------------- STRATEGIES ---------------- */
+
+async function cacheFirst(request){
+
+const hit = await caches.match(request)
+
+if(hit) return hit
+
+const resp = await fetch(request)
+
+if(resp.ok){
+const cache = await caches.open(SHELL_CACHE)
+cache.put(request, resp.clone())
+}
+
+return resp
+
+}
+
+async function store(request, resp){
+
+/* a streamed page is committed to 200 before its data loads; one that
+   failed half-way ends in an error note instead of STREAM_DONE */
+if(resp.headers.has("X-Streamed")){
+const text = await resp.clone().text()
+if(!text.trimEnd().endsWith(STREAM_DONE)) return
+}
+
+const cache = await caches.open(PAGE_CACHE)
+
+await cache.delete(request)
+await cache.put(request, resp)
+await trim(PAGE_CACHE, PAGE_LIMIT)
+
+}
+
+async function staleWhileRevalidate(event){
+
+const request = event.request
+const cache = await caches.open(PAGE_CACHE)
+const hit = await cache.match(request)
+
+const network = fetch(request)
+
+/* stored off to the side, so a streamed page reaches the tab as it
+   arrives rather than once it has been cached */
+event.waitUntil(
+network
+.then(resp => resp.ok ? store(request, resp.clone()) : null)
+.catch(() => null)
+)
+
+if(hit) return hit
+
+try{
+return await network
+}catch(e){
+const home = await caches.match("/")
+return home || Response.error()
+}
+
+}
+
+
+/* ---------------- FETCH ---------------- */
+
+self.addEventListener("fetch", (event) => {
+
+const request = event.request
+
+if(request.method !== "GET") return
+
+const url = new URL(request.url)
+
+if(url.origin !== self.location.origin) return
+
+if(url.pathname.startsWith("/static/dist/")){
+event.respondWith(cacheFirst(request))
+return
+}
+
+if(url.search === "" && PAGE_PATTERNS.some(p => p.test(url.pathname))){
+event.respondWith(staleWhileRevalidate(event))
+}
+
+})
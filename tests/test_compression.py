@@ -0,0 +1,84 @@
+import gzip
+
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+import compression
+
+BODY = b'{"city": "Paris"}' * 100
+
+
+def client(status=200, body=BODY, mimetype="application/json", **headers):
+    app = Response(body, status=status, mimetype=mimetype, headers=headers)
+    return Client(compression.Compress(app, min_size=1024))
+
+
+def get(c, method="GET", encoding="gzip"):
+    return c.open("/", method=method, headers={"Accept-Encoding": encoding})
+
+
+def test_get_is_compressed():
+    resp = get(client())
+
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.headers["Content-Length"] == str(len(resp.data))
+    assert gzip.decompress(resp.data) == BODY
+    assert resp.headers["Vary"] == "Accept-Encoding"
+
+
+def test_head_passes_through():
+    resp = get(client(), method="HEAD")
+
+    assert "Content-Encoding" not in resp.headers
+    assert resp.headers["Content-Length"] == str(len(BODY))
+
+
+def test_without_accept_encoding():
+    resp = get(client(), encoding="identity, gzip;q=0")
+
+    assert "Content-Encoding" not in resp.headers
+    assert resp.data == BODY
+
+
+def test_vary_is_merged():
+    assert get(client(Vary="Cookie")).headers["Vary"] == "Cookie, Accept-Encoding"
+    assert get(client(Vary="accept-encoding")).headers["Vary"] == "accept-encoding"
+
+
+def test_strong_etag_is_weakened():
+    assert get(client(ETag='"abc"')).headers["ETag"] == 'W/"abc"'
+    assert get(client(ETag='W/"abc"')).headers["ETag"] == 'W/"abc"'
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"body": b"{}"},
+    {"status": 404},
+    {"mimetype": "image/png"},
+    {"Content-Encoding": "br"}
+], ids=["small", "not-200", "binary", "encoded"])
+def test_left_alone(kwargs):
+    resp = get(client(**kwargs))
+
+    assert resp.data == kwargs.get("body", BODY)
+    assert resp.headers.get("Content-Encoding") == kwargs.get("Content-Encoding")
+    assert "Vary" not in resp.headers
+
+
+def test_records_stats():
+    before = compression.compression_stats.snapshot()
+    resp = get(client())
+    after = compression.compression_stats.snapshot()
+
+    assert after["responses"] == before["responses"] + 1
+    assert after["bytes_in"] - before["bytes_in"] == len(BODY)
+    assert after["bytes_out"] - before["bytes_out"] == len(resp.data)
+
+
+def test_negotiate_encoding():
+    assert compression.negotiate_encoding("") is None
+    assert compression.negotiate_encoding("gzip;q=0") is None
+    assert compression.negotiate_encoding("gzip, deflate") == "gzip"
+
+    expected = "br" if compression.brotli else "gzip"
+    assert compression.negotiate_encoding("gzip, br") == expected
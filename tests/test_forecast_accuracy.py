@@ -0,0 +1,174 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import forecast_accuracy
+import main
+
+
+def columns(rows, fields):
+    return {
+        name: np.array([r[i] for r in rows], dtype=dtype)
+        for i, (name, dtype) in enumerate(fields)
+    }
+
+
+def forecasts(*rows):
+    # (city_id, valid at, fetched at, temp)
+    return columns(rows, [
+        ("city_id", np.int64),
+        ("ts", "datetime64[s]"),
+        ("fetched", "datetime64[s]"),
+        ("temp", np.float64)
+    ])
+
+
+def observations(*rows):
+    # (city_id, observed at, temp)
+    return columns(rows, [
+        ("city_id", np.int64),
+        ("ts", "datetime64[s]"),
+        ("temp", np.float64)
+    ])
+
+
+def test_scores_per_city_and_lead():
+    fc = forecasts(
+        (1, "2024-01-01T12:00", "2024-01-01T06:00", 10.0),
+        (1, "2024-01-01T15:00", "2024-01-01T09:00", 14.0),
+        (1, "2024-01-01T15:00", "2024-01-01T14:00", 11.0),
+        (2, "2024-01-01T12:00", "2024-01-01T06:00", 0.0)
+    )
+    ob = observations(
+        (1, "2024-01-01T12:10", 12.0),
+        (1, "2024-01-01T15:05", 12.0),
+        (2, "2024-01-01T12:20", 1.0)
+    )
+
+    result = forecast_accuracy.score_forecasts(fc, ob)
+
+    rows = list(zip(
+        result["city_id"].tolist(), result["lead_h"].tolist(),
+        result["n"].tolist(), result["bias"].tolist(),
+        result["mae"].tolist()
+    ))
+
+    assert rows == [
+        (1, 0, 1, -1.0, 1.0),
+        (1, 6, 2, 0.0, 2.0),
+        (2, 6, 1, -1.0, 1.0)
+    ]
+    assert result["matched"] == 4
+    assert result["total"] == 4
+
+
+def test_picks_the_nearest_observation():
+    fc = forecasts((1, "2024-01-01T12:00", "2024-01-01T12:00", 10.0))
+    ob = observations(
+        (1, "2024-01-01T11:40", 0.0),
+        (1, "2024-01-01T12:05", 9.0),
+        (1, "2024-01-01T12:25", 0.0)
+    )
+
+    result = forecast_accuracy.score_forecasts(fc, ob)
+
+    assert result["bias"].tolist() == [1.0]
+
+
+def test_no_match():
+    # another city at the same time, and the right city out of tolerance
+    fc = forecasts(
+        (1, "2024-01-01T12:00", "2024-01-01T06:00", 10.0),
+        (2, "2024-01-01T12:00", "2024-01-01T06:00", 10.0)
+    )
+    ob = observations(
+        (3, "2024-01-01T12:00", 10.0),
+        (2, "2024-01-01T12:31", 10.0)
+    )
+
+    result = forecast_accuracy.score_forecasts(fc, ob)
+
+    assert result["matched"] == 0
+    assert result["total"] == 2
+    assert len(result["n"]) == 0
+    assert len(result["city_id"]) == 0
+
+
+class Cursor(list):
+
+    def batch_size(self, n):
+        return self
+
+
+class Collection:
+
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+        self.calls = []
+
+    def find(self, query, projection=None):
+        return Cursor(self.docs)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append(name)
+
+
+class Database(dict):
+
+    def __missing__(self, name):
+        self[name] = Collection()
+        return self[name]
+
+    __getattr__ = dict.__getitem__
+
+
+@pytest.fixture
+def app():
+    return main.create_app({
+        "OWM_API_KEY": "test",
+        "MONGO_URI": "mongodb://localhost:1/"
+    })
+
+
+def test_command_keeps_summary_when_nothing_matches(app, monkeypatch):
+    now = datetime.utcnow().replace(microsecond=0)
+
+    db = Database(
+        forecasts=Collection([
+            {"city_id": 1, "city": "a", "ts": now, "fetched": now, "temp": 1.0}
+        ]),
+        observations=Collection([
+            {"city_id": 2, "ts": now, "temp": 1.0}
+        ])
+    )
+    monkeypatch.setattr(forecast_accuracy, "get_db", lambda: db)
+
+    out = app.test_cli_runner().invoke(args=["score-forecasts"])
+
+    assert out.exit_code == 0
+    assert "no forecast matched" in out.output
+    assert db["forecast_accuracy"].calls == []
+    assert db[forecast_accuracy.ACCURACY_STAGING].calls == []
+
+
+def test_command_swaps_summary_in_with_a_rename(app, monkeypatch):
+    now = datetime.utcnow().replace(microsecond=0)
+
+    db = Database(
+        forecasts=Collection([
+            {"city_id": 1, "city": "a", "ts": now, "fetched": now, "temp": 1.0}
+        ]),
+        observations=Collection([
+            {"city_id": 1, "ts": now, "temp": 1.0}
+        ])
+    )
+    monkeypatch.setattr(forecast_accuracy, "get_db", lambda: db)
+
+    out = app.test_cli_runner().invoke(args=["score-forecasts"])
+
+    assert out.exit_code == 0
+    assert db["forecast_accuracy"].calls == []
+    assert db[forecast_accuracy.ACCURACY_STAGING].calls == [
+        "drop", "insert_many", "create_index", "rename"
+    ]
@@ -0,0 +1,110 @@
+import random
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import pytest
+
+import main
+
+CONDITIONS = {
+    500: ("Rain", "light rain"),
+    501: ("Rain", "moderate rain"),
+    800: ("Clear", "clear sky"),
+    801: ("Clouds", "few clouds"),
+    802: ("Clouds", "scattered clouds")
+}
+
+START = 1704067200  # 2024-01-01 00:00 UTC
+
+
+def forecast(codes, temps=None, start=START):
+    temps = temps or [float(i % 7) for i in range(len(codes))]
+    items = []
+
+    for i, (code, temp) in enumerate(zip(codes, temps)):
+        dt = start + i * 3 * 3600
+        main_, desc = CONDITIONS[code]
+
+        items.append({
+            "dt": dt,
+            "dt_txt": datetime.utcfromtimestamp(dt).strftime(
+                "%Y-%m-%d %H:%M:%S"
+            ),
+            "main": {"temp": temp, "humidity": 50},
+            "weather": [{"id": code, "main": main_, "description": desc}]
+        })
+
+    return {
+        "list": items,
+        "city": {"id": 1, "name": "Testville", "timezone": 0}
+    }
+
+
+def legacy_days(js, count):
+    # the per-day grouping ForecastModel.days replaced
+    grouped = defaultdict(list)
+
+    for it in js["list"]:
+        grouped[it["dt_txt"].split()[0]].append(it)
+
+    days = []
+
+    for d in sorted(grouped)[:count]:
+        items = grouped[d]
+        temps = [x["main"]["temp"] for x in items]
+
+        main_ = Counter(
+            [x["weather"][0]["main"] for x in items]
+        ).most_common(1)[0][0]
+
+        desc = Counter(
+            [x["weather"][0]["description"] for x in items]
+        ).most_common(1)[0][0]
+
+        days.append({
+            "label": datetime.strptime(d, "%Y-%m-%d").strftime("%a").upper(),
+            "date": datetime.strptime(d, "%Y-%m-%d").strftime("%m/%d"),
+            "icon": main.weather_icon(main_, desc),
+            "hi": round(max(temps)),
+            "lo": round(min(temps)),
+            "desc": desc.capitalize()
+        })
+
+    return days
+
+
+def test_tie_goes_to_first_seen():
+    # Rain has the lower id, but Clear comes first
+    js = forecast([800, 800, 500, 500, 500, 500, 800, 800])
+
+    days = main.ForecastModel(js).days(5)
+
+    assert days[0]["desc"] == "Clear sky"
+    assert days == legacy_days(js, 5)
+
+
+def test_main_and_description_counted_separately():
+    # Clouds wins on main (2 + 2), light rain on description (3)
+    js = forecast([801, 801, 802, 802, 500, 500, 500, 800])
+
+    days = main.ForecastModel(js).days(5)
+
+    assert days[0]["icon"] == main.weather_icon("Clouds", "light rain")
+    assert days[0]["desc"] == "Light rain"
+    assert days == legacy_days(js, 5)
+
+
+def test_partial_first_day():
+    js = forecast([500, 800, 800, 501, 501, 800] * 4, start=START + 15 * 3600)
+
+    assert main.ForecastModel(js).days(5) == legacy_days(js, 5)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_matches_legacy_grouping(seed):
+    rng = random.Random(seed)
+    codes = [rng.choice(list(CONDITIONS)) for _ in range(40)]
+    temps = [round(rng.uniform(-10, 35), 2) for _ in codes]
+    js = forecast(codes, temps, start=START + rng.randrange(8) * 3 * 3600)
+
+    assert main.ForecastModel(js).days(5) == legacy_days(js, 5)
@@ -0,0 +1,86 @@
+import random
+from collections import Counter
+
+import pytest
+
+import main
+
+
+def sketch(k, half_life=60.0):
+    s = main.SpaceSaving(k, half_life)
+    s.landmark = 0.0
+    return s
+
+
+def test_exact_below_k():
+    s = sketch(4)
+
+    for key in "aaab":
+        s.add(key, now=0)
+
+    assert s.snapshot(now=0) == [("a", 3.0, 0.0), ("b", 1.0, 0.0)]
+
+
+def test_evicts_the_smallest_counter():
+    s = sketch(2)
+
+    for key in "aabc":
+        s.add(key, now=0)
+
+    # c takes over b's count as its possible overestimate
+    assert s.snapshot(now=0) == [("a", 2.0, 0.0), ("c", 2.0, 1.0)]
+
+
+def test_counts_decay():
+    s = sketch(4)
+    s.add("a", now=0)
+
+    assert s.snapshot(now=60)[0][1] == pytest.approx(0.5)
+    assert s.snapshot(now=120)[0][1] == pytest.approx(0.25)
+
+
+def test_rescale_moves_the_landmark():
+    s = sketch(4)
+    s.add("a", now=0)
+    s.add("b", now=41 * 60)
+
+    assert s.landmark == 41 * 60
+
+    (b, count_b, _), (a, count_a, _) = s.snapshot(now=41 * 60)
+
+    assert (a, b) == ("a", "b")
+    assert count_b == pytest.approx(1.0)
+    assert count_a == pytest.approx(2 ** -41)
+
+
+def test_rescale_after_a_long_idle_spell():
+    s = sketch(4)
+    s.add("a", now=0)
+
+    # 2 ** (1e9 / 60) would overflow a float
+    s.add("b", now=1e9)
+
+    assert s.snapshot(now=1e9)[0] == ("b", 1.0, 0.0)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_error_bounds(seed):
+    rng = random.Random(seed)
+    # no decay over the test, so counts are plain hit counts
+    s = sketch(16, half_life=1e12)
+    stream = [int(rng.paretovariate(1.2)) for _ in range(2000)]
+
+    for key in stream:
+        s.add(key, now=0)
+
+    true = Counter(stream)
+    found = {key: (count, err) for key, count, err in s.snapshot(now=0)}
+
+    for key, (count, err) in found.items():
+        assert count - err <= true[key] + 1e-6
+        assert true[key] <= count + 1e-6
+
+    # anything above n/k is guaranteed a counter
+    for key, n in true.items():
+        if n > len(stream) / 16:
+            assert key in found
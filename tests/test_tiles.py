@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+
+import pytest
+
+import tiles
+
+TILE = b"x" * 100
+
+
+def fill(cache, count):
+    # tiles 0..count-1 at z=10, oldest first by atime
+    paths = []
+
+    for i in range(count):
+        path = cache.path(10, 0, i)
+        cache.store(path, TILE)
+        os.utime(path, (1000 + i, os.stat(path).st_mtime))
+        paths.append(path)
+
+    return paths
+
+
+def test_store_counts_usage(tmp_path):
+    cache = tiles.TileCache(str(tmp_path), 10000)
+    fill(cache, 3)
+
+    assert cache.usage() == (300, 3)
+
+
+def test_stale_usage_is_rescanned_on_first_store(tmp_path):
+    fill(tiles.TileCache(str(tmp_path), 10000), 3)
+
+    with open(tmp_path / ".usage", "w") as fh:
+        fh.write("999999 42\n")
+
+    cache = tiles.TileCache(str(tmp_path), 10000)
+    cache.store(cache.path(11, 0, 0), TILE)
+
+    assert cache.usage() == (400, 4)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = tiles.TileCache(str(tmp_path), 1000)
+    paths = fill(cache, 10)
+
+    # a read makes tile 0 the most recently used
+    body, _fresh = cache.lookup(paths[0], 60)
+    assert body == TILE
+
+    cache.store(cache.path(10, 0, 10), TILE)
+
+    # down to TILE_EVICT_TO of the limit
+    assert cache.usage() == (900, 9)
+    assert cache.snapshot()["evicted"] == 2
+    assert [os.path.exists(p) for p in paths[:4]] == [True, False, False, True]
+
+
+def test_lookup(tmp_path):
+    cache = tiles.TileCache(str(tmp_path), 10000)
+    path = fill(cache, 1)[0]
+
+    assert cache.lookup(path, 60) == (TILE, True)
+
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert cache.lookup(path, 60) == (TILE, False)
+
+    os.remove(path)
+    assert cache.lookup(path, 60) == (None, False)
+
+
+def test_fetch_coalesces_concurrent_misses(tmp_path):
+    cache = tiles.TileCache(str(tmp_path), 10000)
+    path = cache.path(10, 0, 0)
+    release = threading.Event()
+    loads = []
+    results = []
+
+    def load():
+        loads.append(1)
+        release.wait(5)
+        return TILE
+
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.fetch(path, load)))
+        for _ in range(8)
+    ]
+
+    for t in threads:
+        t.start()
+
+    deadline = time.monotonic() + 5
+
+    while cache.snapshot()["coalesced"] < 7 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    release.set()
+
+    for t in threads:
+        t.join(5)
+
+    assert loads == [1]
+    assert results == [TILE] * 8
+    assert cache.snapshot()["misses"] == 1
+    assert cache.lookup(path, 60) == (TILE, True)
+
+
+def test_fetch_failure_is_not_cached(tmp_path):
+    cache = tiles.TileCache(str(tmp_path), 10000)
+    path = cache.path(10, 0, 0)
+
+    def down():
+        raise OSError("upstream down")
+
+    with pytest.raises(OSError):
+        cache.fetch(path, down)
+
+    assert cache.fetch(path, lambda: TILE) == TILE
+    assert cache.snapshot()["misses"] == 2
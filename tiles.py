@@ -0,0 +1,206 @@
+from concurrent.futures import Future
+from contextlib import contextmanager
+import os
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ================= TILE CACHE =================
+# Tiles are kept on disk under one root as z/x/y.png. Every worker
+# shares the directory, so its total lives in <root>/.usage, updated
+# under an exclusive lock; the worker whose write takes it past
+# max_bytes re-scans the directory and evicts least-recently-used tiles
+# (recency is the file's atime, so the order survives restarts).
+# Concurrent misses for one tile share a single upstream request.
+
+TILE_EVICT_TO = 0.9
+
+
+class _TileUsage:
+
+    def __init__(self, fh):
+        self.fh = fh
+
+    def read(self):
+        self.fh.seek(0)
+        fields = self.fh.read().split()
+
+        if len(fields) != 2:
+            return 0, 0
+
+        return int(fields[0]), int(fields[1])
+
+    def write(self, usage):
+        self.fh.seek(0)
+        self.fh.truncate()
+        self.fh.write("%d %d\n" % usage)
+        self.fh.flush()
+
+
+class TileCache:
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.coalesced = self.evicted = 0
+        # built inside lazy(), which holds the process lock: the directory
+        # is first scanned by this worker's first store() instead
+        self._scanned = False
+
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, z, x, y):
+        return os.path.join(self.root, str(z), str(x), f"{y}.png")
+
+    def lookup(self, path, max_age):
+        # returns (body or None, fresh)
+        try:
+            with open(path, "rb") as fh:
+                body = fh.read()
+                mtime = os.fstat(fh.fileno()).st_mtime
+
+            # it is now the most recently used, whoever wrote it
+            now = time.time()
+            os.utime(path, (now, mtime))
+        except FileNotFoundError:
+            # or evicted by another worker between the read and the touch
+            return None, False
+
+        fresh = now - mtime < max_age
+
+        with self._lock:
+            self.hits += fresh
+
+        return body, fresh
+
+    def store(self, path, body):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        with open(tmp, "wb") as fh:
+            fh.write(body)
+
+        # the tile appears and is counted under one lock, so no worker
+        # ever sees the directory past the limit. A replaced tile is
+        # counted twice until the next scan, which only brings that
+        # scan a little early.
+        with self._usage() as usage:
+            os.replace(tmp, path)
+
+            size, tiles = usage.read()
+            size, tiles = size + len(body), tiles + 1
+
+            # .usage may predate a restart or a manual cleanup
+            if size > self.max_bytes or not self._scanned:
+                size, tiles = self._scan(evict=True)
+                self._scanned = True
+
+            usage.write((size, tiles))
+
+    def usage(self):
+        with self._usage(shared=True) as usage:
+            return usage.read()
+
+    @contextmanager
+    def _usage(self, shared=False):
+        with open(os.path.join(self.root, ".usage"), "a+") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+            yield _TileUsage(fh)
+
+    def _scan(self, evict=False):
+        # the whole directory, whichever worker wrote it; returns
+        # (bytes, tiles) after eviction
+        found = []
+
+        for dirpath, _dirs, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(".png"):
+                    continue
+
+                path = os.path.join(dirpath, name)
+
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                found.append((st.st_atime, path, st.st_size))
+
+        size = sum(nbytes for _atime, _path, nbytes in found)
+        evicted = 0
+
+        # down to TILE_EVICT_TO of the limit, so the next scan is not one
+        # tile away
+        if evict and size > self.max_bytes:
+            found.sort()
+
+            for _atime, path, nbytes in found:
+                if size <= self.max_bytes * TILE_EVICT_TO:
+                    break
+
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+                size -= nbytes
+                evicted += 1
+
+            with self._lock:
+                self.evicted += evicted
+
+        return size, len(found) - evicted
+
+    def fetch(self, path, load):
+        # the first caller for a tile loads it; later callers wait on the
+        # same future instead of hitting upstream again
+        with self._lock:
+            fut = self._inflight.get(path)
+            leader = fut is None
+
+            if leader:
+                fut = self._inflight[path] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return fut.result(timeout=30)
+
+        try:
+            body = load()
+
+            if body is not None:
+                self.store(path, body)
+
+            fut.set_result(body)
+            return body
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(path, None)
+
+    def snapshot(self):
+        size, tiles = self.usage()
+
+        with self._lock:
+            return {
+                "tiles": tiles,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evicted": self.evicted
+            }